@@ -12,6 +12,8 @@ import re
 import select
 import os
 import time
+import stat
+import collections
 
 class ADBConnection:
     """
@@ -54,6 +56,18 @@ class ADBConnection:
     def read(self, n):
         return self.sock.recv(n)
 
+    def readexact(self, n):
+        """
+        reads exactly `n` bytes.
+        """
+        data = b''
+        while len(data) < n:
+            chunk = self.sock.recv(n - len(data))
+            if not chunk:
+                raise Exception("ADB: connection closed")
+            data += chunk
+        return data
+
     def readavailable(self):
         self.sock.setblocking(0)
         timeout_in_seconds = 0.5
@@ -64,6 +78,33 @@ class ADBConnection:
         self.sock.setblocking(1)
         return data
 
+    def readchunks(self, timeout):
+        """
+        yields data as it arrives, until the other side closes the connection,
+        or `timeout` expires.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            self.sock.settimeout(remaining)
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                break
+            finally:
+                self.sock.settimeout(None)
+            if not data:
+                break
+            yield data
+
+    def readall(self, timeout):
+        """
+        reads until the other side closes the connection, or `timeout` expires.
+        """
+        return b''.join(self.readchunks(timeout))
+
 
 class ADBFrameCapture:
     """
@@ -111,21 +152,31 @@ class ADBFrameCapture:
         else:
             raise Exception("unsupported pixel format")
 
-    def capture(self):
+    def captureraw(self):
+        """
+        Capture a frame, and return the undecoded pixel data.
+        The pixel format is described by the `width`, `height` and `rawmode` attributes.
+        """
         if self.version == 2:
             self.conn.write(b'\x00')
-        imgdata = b''
+        chunks = []
+        received = 0
         try:
-            while len(imgdata) < self.size:
-                want = min(self.size-len(imgdata), 1024*1024)
+            while received < self.size:
+                want = min(self.size-received, 1024*1024)
                 data = self.conn.read(want)
-                if data is None:
+                if not data:
                     break
 
-                imgdata += data
+                chunks.append(data)
+                received += len(data)
         except Exception as e:
             print("ERROR %s" % e)
 
+        return b''.join(chunks)
+
+    def capture(self):
+        imgdata = self.captureraw()
         return PIL.Image.frombytes(self.mode, (self.width, self.height), imgdata, "raw", self.rawmode)
 
 
@@ -145,8 +196,12 @@ class ADBShell:
         self.conn.close()
 
     def read(self):
+        """
+        returns the output which arrived within 0.5 seconds, None when there was
+        none, or an empty string when the shell has exited.
+        """
         res = self.conn.readavailable()
-        if res:
+        if res is not None:
             return res.decode('utf-8')
 
     def write(self, cmd):
@@ -185,17 +240,29 @@ class ADBSync:
         """
         downloads / pulls a file from the device.
         """
-        fname = fname.encode('utf-8')
-        self.conn.write(struct.pack("<4sL", b"RECV", len(fname)) + fname)
+        self.writerecv(fname)
+        for data in self.readfile(fname):
+            yield data
+
+    def writerecv(self, fname):
+        """
+        Requests a file, without waiting for the data.
+        """
+        name = fname.encode('utf-8')
+        self.conn.write(struct.pack("<4sL", b"RECV", len(name)) + name)
 
+    def readfile(self, fname):
+        """
+        yields the data of a file requested with RECV.
+        """
         while True:
-            response = self.conn.read(8)
+            response = self.conn.readexact(8)
             magic, datasize = struct.unpack("<4sL", response)
             if magic == b'DONE':
                 break
             if magic == b'FAIL':
-                errmsg = self.conn.read(datasize)
-                raise Exception("file error: %s" % errmsg.decode('utf-8'))
+                errmsg = self.conn.readexact(datasize)
+                raise Exception("file error: %s: %s" % (fname, errmsg.decode('utf-8')))
             if magic != b"DATA":
                 print("m=%s" % magic)
                 raise Exception("expected DATA answer")
@@ -203,24 +270,92 @@ class ADBSync:
             received = 0
             while received < datasize:
                 data = self.conn.read(min(65536, datasize-received))
+                if not data:
+                    raise Exception("ADB: connection closed")
                 yield data
                 received += len(data)
 
-    def put(self, fname, fh):
+    def put(self, fname, fh, mode=0o644):
         """
         Saves data from a stream to a remote file.
         """
-        fname = fname.encode('utf-8')
-        self.conn.write(struct.pack("<4sL", b"SEND", len(fname)) + fname)
-        
+        self.writefile(fname, fh, mode)
+        self.readstatus(fname)
+
+    def writefile(self, fname, fh, mode=0o644, mtime=None):
+        """
+        Sends a file, without waiting for the result.
+        Small files are sent in a single write.
+        """
+        name = ("%s,%d" % (fname, mode)).encode('utf-8')
+        buf = bytearray(struct.pack("<4sL", b"SEND", len(name)) + name)
         while True:
             data = fh.read(65536)
             if not data:
                 break
-            self.conn.write(struct.pack("<4sL", b"DATA", len(data)))
-            self.conn.write(data)
+            buf += struct.pack("<4sL", b"DATA", len(data))
+            buf += data
+            if len(buf) >= 65536:
+                self.conn.write(bytes(buf))
+                buf = bytearray()
+
+        buf += struct.pack("<4sL", b"DONE", int(time.time() if mtime is None else mtime))
+        self.conn.write(bytes(buf))
+
+    def readstatus(self, fname):
+        """
+        Reads the result of a file sent with writefile.
+        """
+        magic, msglen = struct.unpack("<4sL", self.conn.readexact(8))
+        if magic == b'FAIL':
+            errmsg = self.conn.readexact(msglen)
+            raise Exception("file error: %s: %s" % (fname, errmsg.decode('utf-8')))
+        if magic != b'OKAY':
+            raise Exception("expected OKAY answer")
+
+    def pullmany(self, files, window=32):
+        """
+        Download a list of (remotename, localname) files.
+        The files are requested ahead, with at most `window` requests outstanding,
+        and received one after another.
+        A bounded window keeps the requests from blocking on a device which is
+        busy sending file data the host did not read yet.
+        """
+        files = list(files)
+        requested = 0
+        for i, (remote, local) in enumerate(files):
+            while requested < min(len(files), i + window):
+                self.writerecv(files[requested][0])
+                requested += 1
+
+            with open(local, "wb") as fh:
+                try:
+                    for data in self.readfile(remote):
+                        fh.write(data)
+                except Exception:
+                    fh.close()
+                    os.remove(local)
+                    raise
+
+    def pushmany(self, files, window=32):
+        """
+        Upload a list of (localname, remotename) files.
+        Files are sent back-to-back, with at most `window` results outstanding.
+        The remote directories are created by adbd.
+
+        Note that adbd closes the connection after a failure.
+        """
+        pending = collections.deque()
+        for local, remote in files:
+            st = os.stat(local)
+            with open(local, "rb") as fh:
+                self.writefile(remote, fh, stat.S_IMODE(st.st_mode), st.st_mtime)
+            pending.append(remote)
+            if len(pending) > window:
+                self.readstatus(pending.popleft())
 
-        self.conn.write(struct.pack("<4sL", b"DONE", int(time.time())))
+        while pending:
+            self.readstatus(pending.popleft())
 
     def uploadfile(self, srcfile, remotename):
         """
@@ -233,20 +368,52 @@ class ADBSync:
         """
         yields a directory list
         """
+        self.writelist(path)
+        for entry in self.readlist():
+            yield entry
+
+    def writelist(self, path):
         path = path.encode('utf-8')
         self.conn.write(struct.pack("<4sL", b"LIST", len(path)) + path)
 
+    def readlist(self):
+        """
+        yields the entries of a directory list requested with writelist.
+        """
         while True:
-            hdr = self.conn.read(20)
+            hdr = self.conn.readexact(20)
             magic, mode, size, time, nlen = struct.unpack("<4s4L", hdr)
             if magic == b'DONE':
                 break
             if magic != b'DENT':
                 raise Exception("expected DENT or DONE header")
-            name = self.conn.read(nlen)
+            name = self.conn.readexact(nlen)
 
             yield mode, size, time, name.decode('utf-8')
 
+    def listtree(self, path):
+        """
+        returns the lists of (directories, (filename, size)) below `path`.
+        The directories of each level are listed in one batch of requests.
+        """
+        dirs, files = [], []
+        level = [ path.rstrip("/") ]
+        while level:
+            for d in level:
+                self.writelist(d + "/")
+            subdirs = []
+            for d in level:
+                for mode, size, mtime, name in self.readlist():
+                    if name in (".", ".."):
+                        continue
+                    if stat.S_ISDIR(mode):
+                        subdirs.append(d + "/" + name)
+                    elif stat.S_ISREG(mode):
+                        files.append((d + "/" + name, size))
+            dirs += subdirs
+            level = subdirs
+        return dirs, files
+
 class ADB:
     """
     Object for managing an adb connection to a specific device.
@@ -281,6 +448,73 @@ class ADB:
         """
         return ADBSync(self.maketransport(), usev2)
 
+    def transfer(self, groups, action, usev2):
+        """
+        Run `action(sync, files)` for each group of files, each on its own sync connection,
+        in parallel.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        def run(files):
+            sync = self.makesync(usev2)
+            try:
+                action(sync, files)
+            finally:
+                sync.conn.close()
+
+        with ThreadPoolExecutor(max_workers=max(1, len(groups))) as pool:
+            for fut in [ pool.submit(run, files) for files in groups if files ]:
+                fut.result()
+
+    @staticmethod
+    def balance(items, count):
+        """
+        Divide (item, size) pairs over `count` groups of about the same total size.
+        """
+        groups = [ [] for _ in range(count) ]
+        totals = [ 0 ] * count
+        for item, size in sorted(items, key=lambda _: -_[1]):
+            i = totals.index(min(totals))
+            groups[i].append(item)
+            totals[i] += size + 4096     # also count a per file cost
+        return groups
+
+    def pushtree(self, localdir, remotedir, connections=4, usev2=False):
+        """
+        Upload a local directory tree, using several sync connections in parallel.
+        """
+        files = []
+        for dirpath, dirnames, filenames in os.walk(localdir):
+            rel = os.path.relpath(dirpath, localdir)
+            for name in filenames:
+                local = os.path.join(dirpath, name)
+                remote = "/".join(_ for _ in (remotedir.rstrip("/"), rel.replace(os.sep, "/"), name) if _ and _ != ".")
+                files.append(((local, remote), os.path.getsize(local)))
+
+        self.transfer(self.balance(files, connections), ADBSync.pushmany, usev2)
+
+    def pulltree(self, remotedir, localdir, connections=4, usev2=False):
+        """
+        Download a remote directory tree, using several sync connections in parallel.
+        """
+        sync = self.makesync(usev2)
+        try:
+            dirs, files = sync.listtree(remotedir)
+        finally:
+            sync.conn.close()
+
+        remotedir = remotedir.rstrip("/")
+        def localname(remote):
+            return os.path.join(localdir, *remote[len(remotedir)+1:].split("/"))
+
+        for d in [ remotedir ] + dirs:
+            path = localname(d) if d != remotedir else localdir
+            if not os.path.isdir(path):
+                os.makedirs(path)
+
+        items = [ ((remote, localname(remote)), size) for remote, size in files ]
+        self.transfer(self.balance(items, connections), ADBSync.pullmany, usev2)
+
     def exec(self, cmd):
         """
         `exec` can be used as an alternative to the `shell` command.
@@ -292,6 +526,18 @@ class ADB:
         if res:
             return res.decode('utf-8')
 
+    def execstream(self, cmd, timeout=30.0):
+        """
+        `exec` a command, yields the output as it arrives, until the command finishes.
+        """
+        conn = self.maketransport()
+        try:
+            conn.send("exec:%s" % cmd)
+            for data in conn.readchunks(timeout):
+                yield data
+        finally:
+            conn.close()
+
     def version(self):
         """
         Requests the adb version, and optionally launches the adb server.
@@ -329,6 +575,17 @@ class ADB:
         time.sleep(0.1)
         return sh.read()
 
+    def runshell(self, cmd, timeout=30.0):
+        """
+        execute a shell command on the device, and wait for it to finish.
+        returns all output.
+        """
+        sh = self.makeshell(cmd)
+        try:
+            return sh.conn.readall(timeout).decode('utf-8', 'replace')
+        finally:
+            sh.close()
+
     def forward(self, local, remote):
         """
         forward a local port to a device port
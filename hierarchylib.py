@@ -0,0 +1,144 @@
+"""
+Access to the ui hierarchy, as dumped by `uiautomator`.
+
+The xml is streamed from the device, and parsed while it arrives, into a
+`Hierarchy`: a table with one row per node, with indexes on the resource-id,
+text, class and content-desc attributes.
+"""
+from __future__ import print_function, division
+import re
+import array
+import xml.etree.ElementTree as ET
+
+
+class Hierarchy:
+    """
+    A ui hierarchy, stored as a node table.
+
+    Node `i` has its parent in `parent[i]`, -1 for the top level nodes,
+    its bounds in `bounds[4*i:4*i+4]` as left, top, right, bottom,
+    its boolean attributes as bits in `flags[i]`, and its string
+    attributes in `strings[name][i]`.
+
+    `index[name]` maps attribute values to the list of nodes having that value.
+    """
+    STRINGS = ("resource-id", "text", "class", "content-desc", "package")
+    INDEXED = ("resource-id", "text", "class", "content-desc")
+    FLAGS = ("checkable", "checked", "clickable", "enabled", "focusable", "focused",
+             "scrollable", "long-clickable", "password", "selected")
+
+    def __init__(self):
+        self.parent = array.array('i')
+        self.bounds = array.array('i')
+        self.flags = array.array('H')
+        self.strings = dict((name, []) for name in self.STRINGS)
+        self.index = dict((name, {}) for name in self.INDEXED)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add(self, attrib, parent):
+        """
+        Add a node with the attributes from the xml, returns the node number.
+        """
+        i = len(self.parent)
+        self.parent.append(parent)
+
+        m = re.match(r'\[(-?\d+),(-?\d+)\]\[(-?\d+),(-?\d+)\]', attrib.get("bounds", ""))
+        self.bounds.extend([ int(_) for _ in m.groups() ] if m else [0, 0, 0, 0])
+
+        flags = 0
+        for bit, name in enumerate(self.FLAGS):
+            if attrib.get(name) == "true":
+                flags |= 1 << bit
+        self.flags.append(flags)
+
+        for name in self.STRINGS:
+            value = attrib.get(name, "")
+            self.strings[name].append(value)
+            if value and name in self.index:
+                self.index[name].setdefault(value, []).append(i)
+
+        # also index resource ids without the package, as used by monkeyrunner: "id/name".
+        rid = attrib.get("resource-id", "")
+        if rid.find(":") >= 0:
+            self.index["resource-id"].setdefault(rid.split(":", 1)[1], []).append(i)
+
+        return i
+
+    def find(self, name, value):
+        """
+        returns the list of nodes where attribute `name` equals `value`.
+        """
+        return self.index[name].get(value, [])
+
+    def get(self, i, name):
+        return self.strings[name][i]
+
+    def flag(self, i, name):
+        return bool(self.flags[i] & (1 << self.FLAGS.index(name)))
+
+    def rect(self, i):
+        """
+        returns the (left, top, right, bottom) bounds of node `i`.
+        """
+        return tuple(self.bounds[4*i:4*i+4])
+
+    def children(self, i):
+        return [ j for j in range(i+1, len(self.parent)) if self.parent[j] == i ]
+
+
+def parsehierarchy(chunks):
+    """
+    Parse a uiautomator xml dump, arriving in chunks of bytes.
+    Stops reading at the end of the document, so trailing output is ignored.
+    Returns a Hierarchy, or None when no hierarchy was found.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    tree = Hierarchy()
+    stack = []
+    started = False
+    end = b"</hierarchy>"
+    seen = b""
+    for chunk in chunks:
+        if not started:
+            # skip anything output before the xml.
+            buf = seen + chunk
+            i = buf.find(b"<?xml")
+            if i < 0:
+                i = buf.find(b"<hierarchy")
+            if i < 0:
+                seen = buf[-len(end):]
+                continue
+            started = True
+            chunk, seen = buf[i:], b""
+
+        buf = seen + chunk
+        i = buf.find(end)
+        done = i >= 0
+        if done:
+            chunk = chunk[:i + len(end) - len(seen)]
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if elem.tag != "node":
+                continue
+            if event == "start":
+                stack.append(tree.add(elem.attrib, stack[-1] if stack else -1))
+            else:
+                stack.pop()
+                elem.clear()
+        if done:
+            return tree
+        seen = buf[-len(end):]
+
+
+def dumphierarchy(adb, timeout=30.0):
+    """
+    Stream a uiautomator dump from the device, and parse it.
+    Falls back to dumping to a file, for devices which can't dump to /dev/tty.
+    """
+    tree = parsehierarchy(adb.execstream("uiautomator dump /dev/tty", timeout))
+    if tree is None:
+        path = "/data/local/tmp/window_dump.xml"
+        tree = parsehierarchy(adb.execstream("uiautomator dump %s >/dev/null && cat %s" % (path, path), timeout))
+    return tree
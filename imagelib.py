@@ -0,0 +1,542 @@
+"""
+Image analysis helpers for the monkeyrunner compatibility layer.
+
+The functions in this module operate on numpy arrays of shape (height, width, 4),
+containing RGBA pixels as uint8 values, as returned by `toarray`.
+
+Rectangles are passed as (x, y, w, h) tuples, like in the monkeyrunner api.
+"""
+from __future__ import print_function, division
+import numpy
+import PIL.Image
+
+
+def toarray(img):
+    """
+    Convert a PIL Image to a (height, width, 4) RGBA uint8 array.
+    """
+    if img.mode != "RGBA":
+        img = img.convert("RGBA")
+    return numpy.asarray(img)
+
+
+def cliprect(rect, width, height):
+    """
+    Clip a (x, y, w, h) rectangle to the image bounds.
+    returns a (x0, y0, x1, y1) tuple, x1 and y1 exclusive.
+    """
+    if rect is None:
+        return 0, 0, width, height
+    x, y, w, h = rect
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(width, x + w), min(height, y + h)
+    return x0, y0, max(x0, x1), max(y0, y1)
+
+
+def tilerows(width, pixels=1 << 18):
+    """
+    returns the number of rows to process at once, so a tile
+    contains approximately `pixels` pixels.
+    """
+    return max(1, pixels // max(1, width))
+
+
+def absdiff(a, b):
+    """
+    Per channel absolute difference of two uint8 arrays, without overflow.
+    """
+    return numpy.maximum(a, b) - numpy.minimum(a, b)
+
+
+def pixeldiff(a, b, tol):
+    """
+    Returns a boolean (height, width) array, true where a pixel differs by
+    more than `tol`, a (r, g, b, a) array, in any channel.
+    """
+    if tol.any():
+        return (absdiff(a, b) > tol).any(axis=2)
+    # compare whole pixels at once.
+    return a.view(numpy.uint32)[:, :, 0] != b.view(numpy.uint32)[:, :, 0]
+
+
+def countdiff(a, b, tolerance=0, mask=None, maxdiff=None):
+    """
+    Count the pixels where `a` and `b` differ by more than `tolerance` in any channel.
+
+    `tolerance` is either a single value, or a (r, g, b, a) tuple.
+    `mask` is an optional boolean (height, width) array, only pixels where the mask
+    is true are compared.
+    When `maxdiff` is given, the comparison stops as soon as more than `maxdiff`
+    pixels differ, the count returned is then larger than `maxdiff`,
+    but not necessarily the total number of different pixels.
+    """
+    tol = numpy.broadcast_to(numpy.asarray(tolerance, dtype=numpy.uint8), (4,))
+    step = tilerows(a.shape[1])
+    count = 0
+    for y in range(0, a.shape[0], step):
+        differs = pixeldiff(a[y:y+step], b[y:y+step], tol)
+        if mask is not None:
+            differs &= mask[y:y+step]
+        count += int(numpy.count_nonzero(differs))
+        if maxdiff is not None and count > maxdiff:
+            break
+    return count
+
+
+def sumsquares(a, b, mask=None):
+    """
+    Returns the sum of the squared differences of the red, green and blue channels.
+    """
+    step = tilerows(a.shape[1])
+    total = 0
+    for y in range(0, a.shape[0], step):
+        d = absdiff(a[y:y+step, :, :3], b[y:y+step, :, :3]).astype(numpy.uint32)
+        d *= d
+        if mask is not None:
+            d *= mask[y:y+step, :, None]
+        total += int(d.sum(dtype=numpy.uint64))
+    return total
+
+
+def channelbits(bits):
+    """
+    Normalize a quantization to a (rbits, gbits, bbits) tuple,
+    a single number means the same number of bits for each channel.
+    """
+    if isinstance(bits, int):
+        bits = (bits, bits, bits)
+    if len(bits) != 3 or not all(1 <= b <= 8 for b in bits):
+        raise Exception("quantization bits must be between 1 and 8")
+    return tuple(bits)
+
+
+def colorcode(color, bits=3):
+    """
+    Convert a color to a packed quantized color code.
+
+    `color` can be an integer code, a (r, g, b) tuple of quantized values,
+    or a string with one hex digit per quantized channel, like the "%x%x%x"
+    strings used in the example scripts, so with bits=3, "350"
+    is the code for ( r>>5 == 3, g>>5 == 5, b>>5 == 0 ).
+    """
+    rbits, gbits, bbits = channelbits(bits)
+    if isinstance(color, str):
+        if len(color) != 3:
+            raise Exception("expected 3 hex digits in color '%s'" % color)
+        color = tuple(int(c, 16) for c in color)
+    if isinstance(color, tuple):
+        r, g, b = color
+        return (r << (gbits + bbits)) | (g << bbits) | b
+    return int(color)
+
+
+def quantize(a, bits=3):
+    """
+    Returns a (height, width) array with the packed quantized color codes
+    of the RGBA array `a`, keeping the `bits` most significant bits of each
+    channel, packed as: r<<(2*bits) | g<<bits | b.
+    `bits` can also be a (rbits, gbits, bbits) tuple.
+    """
+    rbits, gbits, bbits = channelbits(bits)
+    dtype = numpy.uint16 if rbits + gbits + bbits <= 16 else numpy.uint32
+    plane = (a[:, :, 0] >> (8 - rbits)).astype(dtype)
+    plane <<= gbits
+    plane |= a[:, :, 1] >> (8 - gbits)
+    plane <<= bbits
+    plane |= a[:, :, 2] >> (8 - bbits)
+    return plane
+
+
+def histogram(plane, bits=3):
+    """
+    Count the occurrences of each color code in a quantized plane.
+    returns an array with 2**(3*bits) entries, indexed by color code.
+    """
+    return numpy.bincount(plane.ravel(), minlength=1 << sum(channelbits(bits)))
+
+
+def integral(mask):
+    """
+    Returns the summed-area table of a (height, width) array, with an extra
+    leading row and column of zeros, so that the sum over
+    [y0:y1, x0:x1] == sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0].
+    """
+    height, width = mask.shape
+    sat = numpy.zeros((height + 1, width + 1), dtype=numpy.int64)
+    numpy.cumsum(mask, axis=0, out=sat[1:, 1:])
+    numpy.cumsum(sat[1:, 1:], axis=1, out=sat[1:, 1:])
+    return sat
+
+
+def rectsum(sat, x0, y0, x1, y1):
+    """
+    Returns the sum over a rectangle using a summed-area table.
+    The coordinates can be scalars or numpy arrays.
+    """
+    return sat[y1, x1] - sat[y0, x1] - sat[y1, x0] + sat[y0, x0]
+
+
+def densewindows(sat, window, threshold, stride=None, rect=None, distinct=False):
+    """
+    Find all windows of size `window` (w, h) in the summed-area table `sat`
+    with a sum larger than `threshold`. The windows are positioned on a grid
+    with spacing `stride` (sx, sy), which defaults to half the window size,
+    within `rect`.
+
+    returns a list of (x, y, sum) tuples, with the largest sum first.
+    With `distinct`, windows overlapping a better window are dropped.
+    """
+    w, h = window
+    sx, sy = stride or (max(1, w // 2), max(1, h // 2))
+    x0, y0, x1, y1 = cliprect(rect, sat.shape[1] - 1, sat.shape[0] - 1)
+    xs = numpy.arange(x0, x1 - w + 1, sx)
+    ys = numpy.arange(y0, y1 - h + 1, sy)
+    if not len(xs) or not len(ys):
+        return []
+    gx, gy = numpy.meshgrid(xs, ys)
+    sums = rectsum(sat, gx, gy, gx + w, gy + h)
+    hits = numpy.nonzero(sums > threshold)
+    order = numpy.argsort(-sums[hits], kind="stable")
+    found = []
+    for i in order:
+        iy, ix = hits[0][i], hits[1][i]
+        x, y = int(xs[ix]), int(ys[iy])
+        if distinct and any(abs(x - fx) < w and abs(y - fy) < h for fx, fy, _ in found):
+            continue
+        found.append((x, y, int(sums[iy, ix])))
+    return found
+
+
+def grayscale(a):
+    """
+    Convert a RGBA array to a float32 (height, width) luma array.
+    """
+    g = a[:, :, 0] * numpy.float32(0.299)
+    g += a[:, :, 1] * numpy.float32(0.587)
+    g += a[:, :, 2] * numpy.float32(0.114)
+    return g
+
+
+def downsample(g):
+    """
+    Halve the size of a grayscale array by averaging 2x2 blocks.
+    """
+    h, w = g.shape[0] // 2, g.shape[1] // 2
+    return g[:2*h, :2*w].reshape(h, 2, w, 2).mean(axis=(1, 3), dtype=numpy.float32)
+
+
+def pyramid(g, levels):
+    """
+    returns a list of `levels`+1 arrays, each half the size of the previous one.
+    """
+    result = [g]
+    for _ in range(levels):
+        result.append(downsample(result[-1]))
+    return result
+
+
+def pyramidlevels(tsize, minsize=8, maxlevels=4):
+    """
+    Returns the number of pyramid levels to use for a template of size (w, h),
+    such that the template is still at least `minsize` pixels at the coarsest level.
+    """
+    levels = 0
+    while levels < maxlevels and min(tsize) >> (levels + 1) >= minsize:
+        levels += 1
+    return levels
+
+
+class TemplatePyramid:
+    """
+    The zero mean version of a grayscale template, and its norm, at
+    each pyramid level.
+    """
+    def __init__(self, g, levels):
+        self.levels = []
+        for t in pyramid(g, levels):
+            t = t - t.mean()
+            self.levels.append((t, float(numpy.sqrt((t * t).sum()))))
+        self.width, self.height = g.shape[1], g.shape[0]
+
+
+def nccfull(g, t, tnorm):
+    """
+    Normalized cross correlation of template `t` at every position in `g`,
+    calculated using a FFT for the correlation, and summed-area tables for the
+    normalization.  `t` must have zero mean, `tnorm` is its norm.
+
+    returns a (H-h+1, W-w+1) array with scores in the range -1 .. 1
+    """
+    H, W = g.shape
+    h, w = t.shape
+    if h > H or w > W or not tnorm:
+        return numpy.zeros((max(0, H-h+1), max(0, W-w+1)), dtype=numpy.float32)
+    corr = numpy.fft.irfft2(numpy.fft.rfft2(g) * numpy.conj(numpy.fft.rfft2(t, (H, W))), (H, W))
+    corr = corr[:H-h+1, :W-w+1]
+
+    s1 = numpy.zeros((H + 1, W + 1))
+    s2 = numpy.zeros((H + 1, W + 1))
+    numpy.cumsum(numpy.cumsum(g, axis=0, dtype=numpy.float64), axis=1, out=s1[1:, 1:])
+    numpy.cumsum(numpy.cumsum(numpy.square(g, dtype=numpy.float64), axis=0), axis=1, out=s2[1:, 1:])
+    wsum = s1[h:, w:] - s1[:-h, w:] - s1[h:, :-w] + s1[:-h, :-w]
+    wsq = s2[h:, w:] - s2[:-h, w:] - s2[h:, :-w] + s2[:-h, :-w]
+    var = numpy.maximum(wsq - wsum * wsum / (h * w), 0)
+
+    den = numpy.sqrt(var) * tnorm
+    return numpy.where(den > 1e-6 * tnorm * tnorm, corr / numpy.maximum(den, 1e-12), 0).astype(numpy.float32)
+
+
+def ncclocal(g, t, tnorm, x, y, radius):
+    """
+    Normalized cross correlation of template `t` in `g`, only evaluated
+    at positions within `radius` of (x, y).
+
+    returns the best (x, y, score)
+    """
+    H, W = g.shape
+    h, w = t.shape
+    x0, y0 = max(0, x - radius), max(0, y - radius)
+    x1, y1 = min(W - w, x + radius), min(H - h, y + radius)
+    if x1 < x0 or y1 < y0 or not tnorm:
+        return x, y, -1.0
+    area = g[y0:y1+h, x0:x1+w]
+    windows = numpy.lib.stride_tricks.sliding_window_view(area, (h, w))
+    num = numpy.einsum("ijkl,kl->ij", windows, t, dtype=numpy.float64)
+    wsum = windows.sum(axis=(2, 3), dtype=numpy.float64)
+    wsq = numpy.einsum("ijkl,ijkl->ij", windows, windows, dtype=numpy.float64)
+    den = numpy.sqrt(numpy.maximum(wsq - wsum * wsum / (h * w), 0)) * tnorm
+    score = numpy.where(den > 1e-6 * tnorm * tnorm, num / numpy.maximum(den, 1e-12), 0)
+    iy, ix = numpy.unravel_index(numpy.argmax(score), score.shape)
+    return x0 + int(ix), y0 + int(iy), float(score[iy, ix])
+
+
+def suppress(matches, w, h):
+    """
+    From a list of (x, y, score) tuples, drop the matches overlapping a
+    better match by more than half the template size.
+    """
+    result = []
+    for x, y, score in sorted(matches, key=lambda m: -m[2]):
+        if any(abs(x - rx) < w // 2 + 1 and abs(y - ry) < h // 2 + 1 for rx, ry, _ in result):
+            continue
+        result.append((x, y, score))
+    return result
+
+
+def matchtemplate(levels, tpyr, threshold, rect=None, maxmatches=10, coarsefactor=0.7):
+    """
+    Coarse to fine template search.
+
+    `levels` is the image pyramid, with at least as many levels as the template pyramid `tpyr`.
+    The full correlation is only calculated at the coarsest level, candidates scoring
+    above `coarsefactor` * `threshold` there are refined level by level, in a small
+    neighbourhood.
+
+    returns a list of (x, y, score) tuples, best match first.
+    """
+    nlevels = len(tpyr.levels) - 1
+    x0, y0, x1, y1 = cliprect(rect, levels[0].shape[1], levels[0].shape[0])
+
+    g = levels[nlevels][y0 >> nlevels:-(-y1 >> nlevels), x0 >> nlevels:-(-x1 >> nlevels)]
+    t, tnorm = tpyr.levels[nlevels]
+    scores = nccfull(g, t, tnorm)
+    ys, xs = numpy.nonzero(scores >= threshold * coarsefactor)
+    order = numpy.argsort(-scores[ys, xs], kind="stable")
+    candidates = suppress([(int(xs[i]) + (x0 >> nlevels), int(ys[i]) + (y0 >> nlevels), float(scores[ys[i], xs[i]]))
+                           for i in order[:50 * maxmatches]], t.shape[1], t.shape[0])[:4 * maxmatches]
+
+    matches = []
+    for x, y, score in candidates:
+        for level in range(nlevels - 1, -1, -1):
+            t, tnorm = tpyr.levels[level]
+            x, y, score = ncclocal(levels[level], t, tnorm, 2 * x, 2 * y, 2)
+        if score >= threshold and x0 <= x and y0 <= y and x + tpyr.width <= x1 and y + tpyr.height <= y1:
+            matches.append((x, y, score))
+    return suppress(matches, tpyr.width, tpyr.height)[:maxmatches]
+
+
+def resize(g, size):
+    """
+    Resize a grayscale array to `size` (w, h), by averaging the pixels
+    covered by each destination pixel.
+    """
+    return numpy.asarray(PIL.Image.fromarray(g, "F").resize(size, PIL.Image.BOX))
+
+
+def dctmatrix(n):
+    """
+    Returns the n x n orthonormal DCT-II matrix.
+    """
+    k = numpy.arange(n)[:, None]
+    m = numpy.cos(numpy.pi * (2 * numpy.arange(n)[None, :] + 1) * k / (2 * n)) * numpy.sqrt(2.0 / n)
+    m[0] /= numpy.sqrt(2.0)
+    return m
+
+
+def hashbits(g, method="dhash", size=8):
+    """
+    Calculate a perceptual hash of a grayscale array.
+
+    method:
+      dhash - compares the brightness of horizontally adjacent cells of a
+              (size+1) x size thumbnail.
+      phash - compares the lowest size x size DCT coefficients of a 4*size square
+              thumbnail with their median.
+
+    returns a boolean array with size*size bits.
+    """
+    if method == "dhash":
+        small = resize(g, (size + 1, size))
+        return (small[:, 1:] > small[:, :-1]).ravel()
+    if method == "phash":
+        d = dctmatrix(4 * size)
+        coefs = (d @ resize(g, (4 * size, 4 * size)) @ d.T)[:size, :size].ravel()
+        return coefs > numpy.median(coefs[1:])
+    raise Exception("unknown hash method: %s" % method)
+
+
+def packwords(bits):
+    """
+    Pack a boolean array into an array of uint64 words.
+    """
+    data = numpy.packbits(bits)
+    data = numpy.concatenate((data, numpy.zeros(-len(data) % 8, dtype=numpy.uint8)))
+    return data.view(">u8").astype(numpy.uint64)
+
+
+_popcounts = numpy.array([bin(i).count("1") for i in range(256)], dtype=numpy.uint8)
+
+def hamming(words, query):
+    """
+    Returns the number of different bits between each row of `words`,
+    a (N, nwords) uint64 array, and `query`, a (nwords,) uint64 array.
+    """
+    x = numpy.bitwise_xor(words, query)
+    if hasattr(numpy, "bitwise_count"):
+        return numpy.bitwise_count(x).sum(axis=1, dtype=numpy.int32)
+    return _popcounts[x.view(numpy.uint8)].sum(axis=1, dtype=numpy.int32)
+
+
+def argb(a):
+    """
+    Reorder the last axis of a RGBA array to ARGB, as used by getRawPixel.
+    """
+    return a[..., [3, 0, 1, 2]]
+
+
+def packargb(a):
+    """
+    Pack the pixels of a RGBA array into signed 32 bit ARGB integers, with
+    the alpha channel set to 0xff, as returned by getRawPixelInt.
+    """
+    packed = numpy.full(a.shape[:-1], 0xff000000, dtype=numpy.uint32)
+    packed |= a[..., 0].astype(numpy.uint32) << 16
+    packed |= a[..., 1].astype(numpy.uint32) << 8
+    packed |= a[..., 2]
+    return packed.view(numpy.int32)
+
+
+# raw framebuffer formats, as PIL rawmodes: bytes per pixel, and the
+# byte offsets of the red, green, blue and alpha channels.
+RAWFORMATS = {
+    "RGBA": (4, (0, 1, 2, 3)),
+    "RGBX": (4, (0, 1, 2, None)),
+    "BGRA": (4, (2, 1, 0, 3)),
+    "RGB":  (3, (0, 1, 2, None)),
+}
+
+
+def rawpixel(data, width, rawmode, x, y):
+    """
+    Decode a single pixel from a raw framebuffer, returns a (r, g, b, a) tuple.
+    """
+    if rawmode == "RGB;16":
+        ofs = 2 * (y * width + x)
+        v = data[ofs] | (data[ofs + 1] << 8)
+        return (v & 31) * 255 // 31, ((v >> 5) & 63) * 255 // 63, (v >> 11) * 255 // 31, 255
+    bpp, (r, g, b, a) = RAWFORMATS[rawmode]
+    ofs = bpp * (y * width + x)
+    return data[ofs + r], data[ofs + g], data[ofs + b], 255 if a is None else data[ofs + a]
+
+
+def rawarray(data, size, rawmode, rect=None):
+    """
+    Decode a part of a raw framebuffer to a RGBA array.
+    Only the pixels inside `rect` are decoded, for the "RGBA" format
+    the result is a view on `data`, no pixels are copied at all.
+    """
+    width, height = size
+    x0, y0, x1, y1 = cliprect(rect, width, height)
+    if rawmode == "RGB;16":
+        v = numpy.frombuffer(data, "<u2", count=width * height).reshape(height, width)[y0:y1, x0:x1]
+        out = numpy.empty(v.shape + (4,), dtype=numpy.uint8)
+        out[..., 0] = (v & 31).astype(numpy.uint16) * 255 // 31
+        out[..., 1] = ((v >> 5) & 63) * 255 // 63
+        out[..., 2] = (v >> 11) * 255 // 31
+        out[..., 3] = 255
+        return out
+    bpp, offsets = RAWFORMATS[rawmode]
+    px = numpy.frombuffer(data, numpy.uint8, count=width * height * bpp).reshape(height, width, bpp)[y0:y1, x0:x1]
+    if rawmode == "RGBA":
+        return px
+    out = numpy.empty(px.shape[:2] + (4,), dtype=numpy.uint8)
+    for i, ofs in enumerate(offsets):
+        out[..., i] = 255 if ofs is None else px[..., ofs]
+    return out
+
+
+def saveoptions(format, level=None, quality=None):
+    """
+    Returns the PIL format name, and the options passed to PIL.Image.save.
+
+    `level` is either "fastest", or a number from 0 (fast, large) to 9 (slow, small).
+    `quality` is used for the lossy formats, jpeg and webp, from 1 to 100.
+    """
+    format = format.lower()
+    fastest = level == "fastest"
+    if format == "png":
+        return "PNG", { "compress_level": 1 if fastest else (6 if level is None else int(level)) }
+    if format in ("jpg", "jpeg"):
+        options = { "quality": quality or (75 if fastest else 90) }
+        if level is not None and not fastest:
+            options["optimize"] = int(level) >= 5
+        return "JPEG", options
+    if format == "webp":
+        options = { "quality": quality or (75 if fastest else 90) }
+        options["method"] = 0 if fastest else (4 if level is None else int(level) * 6 // 9)
+        return "WEBP", options
+    raise Exception("unsupported image format: %s" % format)
+
+
+def encode(img, format, level=None, quality=None):
+    """
+    Encode a PIL Image to a complete image file in memory.
+    """
+    import io
+    name, options = saveoptions(format, level, quality)
+    if name == "JPEG" and img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    fh = io.BytesIO()
+    img.save(fh, name, **options)
+    return fh.getvalue()
+
+
+def difftiles(a, b, tilesize, tolerance=0):
+    """
+    Compare two RGBA arrays in square tiles of `tilesize` pixels.
+    returns a boolean (rows, columns) array, true for the tiles containing
+    pixels which differ by more than `tolerance` in any channel.
+    """
+    height, width = a.shape[:2]
+    rows, cols = -(-height // tilesize), -(-width // tilesize)
+    tiles = numpy.zeros((rows, cols), dtype=bool)
+    tol = numpy.broadcast_to(numpy.asarray(tolerance, dtype=numpy.uint8), (4,))
+    step = tilerows(width, 1 << 18) // tilesize * tilesize or tilesize
+    for y in range(0, height, step):
+        differs = pixeldiff(a[y:y+step], b[y:y+step], tol)
+        h = differs.shape[0]
+        padded = numpy.zeros((-(-h // tilesize) * tilesize, cols * tilesize), dtype=bool)
+        padded[:h, :width] = differs
+        r = y // tilesize
+        tiles[r:r + padded.shape[0] // tilesize] = padded.reshape(-1, tilesize, cols, tilesize).any(axis=(1, 3))
+    return tiles
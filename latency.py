@@ -0,0 +1,145 @@
+"""
+Script measuring the input-to-display latency of an android device.
+
+It repeatedly sends a tap or key press using `monkey`, and then captures
+the screen as fast as possible, using the `adb` `framebuffer` function,
+until a region of the screen changes.
+
+Usage:
+
+    python3 latency.py --region 0,0,1080,200 tap 540 1200
+    python3 latency.py --trials 50 --reset 4 press 82
+
+"""
+from __future__ import print_function, division
+import time
+from adblib import ADB
+from monkeylib import Monkey
+import imagelib
+
+
+class LatencyMeter:
+    """
+    Measures the time between an input event being acknowledged by monkey,
+    and the first screen capture which shows a change in `region`.
+
+    The next capture connection is always prepared in advance, with v2
+    framebuffer servers the capture then only starts when triggered, the time
+    of the trigger is used as the time of the frame.
+    """
+    def __init__(self, adb, region=None, tolerance=0):
+        self.adb = adb
+        self.region = region
+        self.tolerance = tolerance
+        self.nextcap = None
+
+    def capture(self):
+        """
+        returns the (timestamp, RGBA pixels of the region) of a new frame.
+        """
+        cap, self.nextcap = self.nextcap, None
+        t = time.monotonic()
+        if cap is None:
+            # v1 servers capture as soon as the connection is made.
+            cap = self.adb.makecapture()
+        data = cap.captureraw()
+        cap.conn.close()
+        if cap.version == 2:
+            self.nextcap = self.adb.makecapture()
+        return t, imagelib.rawarray(data, (cap.width, cap.height), cap.rawmode, self.region)
+
+    def trial(self, action, timeout=2.0):
+        """
+        Execute `action`, a function sending an input event to the device,
+        returns the latency in seconds, or None when no change was seen within `timeout`.
+        """
+        _, ref = self.capture()
+        action()
+        tack = time.monotonic()
+        while time.monotonic() < tack + timeout:
+            t, frame = self.capture()
+            if imagelib.countdiff(ref, frame, self.tolerance, maxdiff=0):
+                return max(0.0, t - tack)
+
+    def measure(self, action, trials=20, reset=None, pause=1.0, timeout=2.0):
+        """
+        Run a number of trials, returns the list of latencies.
+        `reset` is an optional function restoring the screen after each trial,
+        `pause` the time to wait before the next trial, to let the screen settle.
+        """
+        samples = []
+        for _ in range(trials):
+            latency = self.trial(action, timeout)
+            if latency is not None:
+                samples.append(latency)
+            print("latency: %s" % ("%.1f msec" % (latency * 1000) if latency is not None else "timeout"))
+            if reset:
+                reset()
+            time.sleep(pause)
+        return samples
+
+
+def percentile(samples, p):
+    """
+    returns the p-th percentile of the samples, by linear interpolation.
+    """
+    values = sorted(samples)
+    if not values:
+        return
+    k = (len(values) - 1) * p / 100
+    i = int(k)
+    if i + 1 >= len(values):
+        return values[-1]
+    return values[i] + (values[i + 1] - values[i]) * (k - i)
+
+
+def summary(samples):
+    """
+    returns a dict with the latency distribution, in seconds.
+    """
+    result = dict(("p%d" % p, percentile(samples, p)) for p in (50, 90, 95, 99))
+    result["count"] = len(samples)
+    result["min"] = min(samples) if samples else None
+    result["max"] = max(samples) if samples else None
+    return result
+
+
+def start():
+    import argparse
+    parser = argparse.ArgumentParser(description='measure input-to-display latency')
+    parser.add_argument('--region', type=str, help='x,y,w,h of the screen region to watch')
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--pause', type=float, default=1.0, help='seconds between trials')
+    parser.add_argument('--timeout', type=float, default=2.0)
+    parser.add_argument('--tolerance', type=int, default=0, help='per channel pixel tolerance')
+    parser.add_argument('--reset', type=int, help='keycode pressed after each trial')
+    parser.add_argument('action', choices=['tap', 'press'])
+    parser.add_argument('args', type=int, nargs='+', help='x y for tap, keycode for press')
+    args = parser.parse_args()
+
+    adb = ADB()
+    adb.connect()
+    mon = Monkey.launchmonkey(adb)
+    if not mon:
+        return
+
+    if args.action == 'tap':
+        action = lambda: mon.tap((args.args[0], args.args[1]))
+    else:
+        action = lambda: mon.keyevent(args.args[0])
+    reset = (lambda: mon.keyevent(args.reset)) if args.reset is not None else None
+
+    region = tuple(int(_) for _ in args.region.split(",")) if args.region else None
+    meter = LatencyMeter(adb, region, args.tolerance)
+    samples = meter.measure(action, args.trials, reset, args.pause, args.timeout)
+
+    result = summary(samples)
+    print("%d of %d trials" % (result["count"], args.trials))
+    if samples:
+        for key in ("min", "p50", "p90", "p95", "p99", "max"):
+            print("%-5s %7.1f msec" % (key, result[key] * 1000))
+        print("samples: %s" % " ".join("%.1f" % (_ * 1000) for _ in samples))
+
+
+if __name__=='__main__':
+    start()
@@ -4,8 +4,11 @@ Provide an interface to the android 'monkey.jar' ui control interface.
 """
 import socket
 import time
-import select
 import re
+import threading
+import collections
+import contextlib
+import io
 
 """
 Commands implemented by the daemon running on the Android device.
@@ -35,37 +38,390 @@ getviewswithtext  "text"
 """
 
 
+def ease(t):
+    """ slow start, and slow end """
+    return t*t*(3-2*t)
+
+def easein(t):
+    """ slow start """
+    return t*t
+
+def easeout(t):
+    """ slow end """
+    return t*(2-t)
+
+EASINGS = {
+    "linear": lambda t: t,
+    "ease": ease,
+    "easein": easein,
+    "easeout": easeout,
+}
+
+def bezier(points, t):
+    """
+    Evaluate the bezier curve through `points` at t, using de Casteljau's algorithm.
+    """
+    while len(points) > 1:
+        points = [ (a[0] + (b[0]-a[0])*t, a[1] + (b[1]-a[1])*t) for a, b in zip(points, points[1:]) ]
+    return points[0]
+
+def gesturepath(frm, to, steps, easing="linear", control=None):
+    """
+    Returns steps+1 integer positions from `frm` to `to`.
+
+    `easing` is a name from EASINGS, or a function mapping [0..1] to [0..1],
+    determining the progress along the path at each step.
+    `control` is an optional list of bezier control points, the path is
+    a straight line without them.
+    """
+    if not callable(easing):
+        easing = EASINGS[easing]
+    curve = [frm] + list(control or []) + [to]
+    path = []
+    for i in range(steps+1):
+        x, y = bezier(curve, easing(i / steps))
+        path.append((int(round(x)), int(round(y))))
+    return path
+
+
+def quotearg(txt):
+    """
+    Quote an argument containing spaces, for the monkey command parser.
+    """
+    if txt.find(" ") >= 0:
+        return '"%s"' % txt.replace('"', '\\"')
+    return txt
+
+def splitcommand(line):
+    """
+    Split a command line the way the monkey command parser does: on runs of
+    whitespace, a word starting with a double quote continues up to the first
+    word ending with one, and '\\"' is replaced by '"'.
+    A quoted argument ending without a closing quote is dropped.
+    """
+    args = []
+    quoted = None
+    for raw in line.split():
+        word = raw.replace('\\"', '"')
+        if quoted is None and raw.startswith('"'):
+            quoted = word
+        elif quoted is not None:
+            quoted += " " + word
+            if raw.endswith('"'):
+                args.append(quoted[1:-1])
+                quoted = None
+        else:
+            args.append(word)
+    return args
+
+def okvalue(response):
+    """
+    returns the value of an "OK:<value>" response, None for errors.
+    """
+    if response and response.startswith('OK'):
+        return response[3:]
+
+def parseids(txt):
+    """
+    Converts a "windowid viewid windowid viewid ..." response to a list of (windowid, viewid) tuples.
+    """
+    values = [ int(_) for _ in txt.split() ]
+    return list(zip(values[0::2], values[1::2]))
+
+
+class MonkeyFuture:
+    """
+    The response to a command sent with `Monkey.post`.
+    """
+    def __init__(self, monkey, cmd):
+        self.monkey = monkey
+        self.cmd = cmd
+        self.response = None
+        self.finished = False
+
+    def done(self):
+        """
+        True when the response was received.
+        """
+        return self.finished
+
+    def result(self, timeout=0.5):
+        """
+        Waits for the response, returns None when it did not arrive within `timeout` seconds.
+        """
+        if not self.finished:
+            self.monkey.collect(self, timeout)
+        return self.response
+
+
+class MonkeyBatch:
+    """
+    Sends commands back-to-back, without waiting for their responses.
+    Obtained from `Monkey.batch`.
+    """
+    def __init__(self, monkey):
+        self.monkey = monkey
+        self.futures = []
+        self.results = None
+
+    def command(self, cmd):
+        fut = self.monkey.post(cmd)
+        self.futures.append(fut)
+        return fut
+
+    def keyevent(self, key):
+        return self.command("press %s" % key)
+
+    def key(self, type, key):
+        return self.command("key %s %s" % (type, key))
+
+    def sendtext(self, txt):
+        return self.command("type %s" % quotearg(txt))
+
+    def touch(self, how, pos):
+        return self.command("touch %s %d %d" % (how, pos[0], pos[1]))
+
+    def tap(self, pos):
+        return self.command("tap %d %d" % (pos[0], pos[1]))
+
+    def sleep(self, msec):
+        """
+        let the daemon pause before executing the next command.
+        """
+        return self.command("sleep %d" % msec)
+
+    def getrootview(self):
+        return self.command("getrootview")
+
+    def queryview(self, view, cmd):
+        return self.command("queryview %s %s" % (view, cmd))
+
+    def getviewswithtext(self, text):
+        return self.command("getviewswithtext %s" % quotearg(text))
+
+    def listviews(self):
+        return self.command("listviews")
+
+    def wait(self, timeout=5.0):
+        """
+        Collect all responses, returns the list of response strings,
+        with None for responses which did not arrive within `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        self.results = [fut.result(max(0, deadline - time.monotonic())) for fut in self.futures]
+        return self.results
+
+    def ok(self):
+        """
+        True when all commands returned OK.
+        """
+        return all(res is not None and res.startswith("OK") for res in self.results or ())
+
+
+class MonkeyScript:
+    """
+    Builds a script for the monkey tool, which then runs it on the device,
+    with its own timing, see `run`.
+    """
+    ACTIONS = { "down": 0, "up": 1, "move": 2 }
+    HEADER = "type= raw events\ncount= 1\nspeed= 1.0\nstart data >>\n"
+
+    def __init__(self):
+        self.events = []
+        self.waittime = 0     # in msec
+
+    def tap(self, pos):
+        self.events.append("Tap(%d,%d)" % (pos[0], pos[1]))
+
+    def touch(self, how, pos):
+        self.events.append("DispatchPointer(0,0,%d,%d,%d,1.0,1.0,0,0,0,0,0)" % (self.ACTIONS[how], pos[0], pos[1]))
+
+    def keyevent(self, key):
+        """
+        press a key, by name (KEYCODE_...), or by number.
+        """
+        if isinstance(key, int) or key.isdigit():
+            self.key("down", key)
+            self.key("up", key)
+        else:
+            self.events.append("DispatchPress(%s)" % key)
+
+    def key(self, type, key):
+        """
+        DispatchKey needs the numeric keycode.
+        """
+        if not isinstance(key, int) and not key.isdigit():
+            raise Exception("key %s: monkey scripts need a numeric keycode for separate down/up events" % key)
+        self.events.append("DispatchKey(0,0,%d,%d,0,0,0,0)" % (self.ACTIONS[type], int(key)))
+
+    def sendtext(self, txt):
+        """
+        monkey types this using 'input text', which takes a single argument,
+        spaces are passed as '%s'.
+        """
+        if re.search(r'[,)\n]', txt):
+            raise Exception("text in monkey scripts can not contain ',', ')' or newlines")
+        self.events.append("DispatchString(%s)" % txt.replace(" ", "%s"))
+
+    def sleep(self, msec):
+        msec = int(round(msec))
+        if msec > 0:
+            self.events.append("UserWait(%d)" % msec)
+            self.waittime += msec
+
+    def drag(self, frm, to, duration, steps, easing="linear", control=None):
+        """
+        same timing as `Monkey.drag`.
+        """
+        points = gesturepath(frm, to, steps, easing, control)
+        dt = duration * 1000 / (steps+1)
+
+        self.touch("down", points[0])
+        for pos in points[1:]:
+            self.sleep(dt)
+            self.touch("move", pos)
+        self.sleep(dt)
+        self.touch("up", points[-1])
+
+    def compile(self):
+        """
+        returns the script text.
+        """
+        return self.HEADER + "".join(_ + "\n" for _ in self.events)
+
+    def run(self, adb, path="/data/local/tmp/monkeyscript.txt", timeout=None):
+        """
+        Upload the script to the device, and run it.
+        Returns the monkey output, or None when it exited without finishing, or did
+        not finish within `timeout` seconds, by default 30 seconds more than the total
+        sleep time in the script.
+        """
+        sync = adb.makesync(usev2=False)
+        sync.put(path, io.BytesIO(self.compile().encode('utf-8')))
+        sync.conn.close()
+
+        if timeout is None:
+            timeout = self.waittime / 1000 + 30.0
+        deadline = time.monotonic() + timeout
+
+        sh = adb.makeshell("monkey -v -f %s 1" % path)
+        log = ""
+        try:
+            while time.monotonic() < deadline:
+                resp = sh.read()
+                if resp == "":
+                    break
+                if resp:
+                    log += resp
+                    if log.find("// Monkey finished") >= 0 or log.find("Monkey aborted") >= 0:
+                        return log
+        finally:
+            sh.close()
+
 class Monkey:
     """
     Class managing a monkey connection.
+
+    The daemon handles commands in order, and answers each with one line.
+    So commands can be pipelined: `post` sends a command and returns a
+    `MonkeyFuture`, responses are matched in order to the pending futures.
     """
     def __init__(self, port):
         self.sock = socket.socket()
         self.sock.connect(("127.0.0.1", port))
+        # commands are tiny, don't let Nagle's algorithm hold them back.
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # bytes received, but not yet returned by readuntil.
+        self.rbuf = b''
+
+        # futures waiting for a response, in the order the commands were sent.
+        self.pending = collections.deque()
+        self.sendlock = threading.Lock()
+        self.recvlock = threading.Lock()
+
+        # the (from, to) positions of the most recent drag.
+        self.lastdrag = None
 
     def send(self, cmd, timeout=0.5):
-        self.sock.send((cmd + "\n").encode('utf-8'))
-        res = self.readuntil(b"\n", timeout)
-        if res:
-            return res.decode('utf-8')
+        return self.post(cmd).result(timeout)
+
+    def post(self, cmd):
+        """
+        Send a command without waiting for the response, returns a `MonkeyFuture`.
+        """
+        fut = MonkeyFuture(self, cmd)
+        with self.sendlock:
+            self.pending.append(fut)
+            try:
+                self.sock.sendall((cmd + "\n").encode('utf-8'))
+            except Exception:
+                self.pending.remove(fut)
+                raise
+        return fut
+
+    def collect(self, fut, timeout):
+        """
+        Read responses, and hand them to the pending futures,
+        until `fut` has its response, or `timeout` expires.
+        A response arriving late is still matched to the right future.
+        """
+        deadline = time.monotonic() + timeout
+        with self.recvlock:
+            while not fut.finished:
+                res = self.readuntil(b"\n", deadline - time.monotonic())
+                if res is None:
+                    return
+                with self.sendlock:
+                    if not self.pending:
+                        # not an answer to any of our commands.
+                        continue
+                    first = self.pending.popleft()
+                first.response = res.decode('utf-8')
+                first.finished = True
+
+    @contextlib.contextmanager
+    def batch(self, timeout=5.0):
+        """
+        Context sending all commands back-to-back, the responses
+        are collected when the context exits:
+
+            with mon.batch() as b:
+                b.tap((100, 200))
+                b.sleep(50)
+                b.keyevent("KEYCODE_BACK")
+            print(b.results)
+        """
+        b = MonkeyBatch(self)
+        yield b
+        b.wait(timeout)
 
     def readuntil(self, char, timeout):
-        self.sock.setblocking(0)
-        buf = b''
-        foundchar = False
-        tstart = time.time()
-        tend = tstart + timeout
-        while time.time() < tend:
-            ready = select.select([self.sock], [], [], 0.1)
-            if ready[0]:
-                c = self.sock.recv(1)
-                if c == char:
-                    foundchar = True
-                    break
-                buf += c
-        self.sock.setblocking(1)
-        if foundchar:
-            return buf
+        """
+        Returns the data up to `char`, reading as much as is available at once.
+        Data following `char` is kept for the next call.
+        Returns None when `char` was not received within `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            i = self.rbuf.find(char)
+            if i >= 0:
+                line, self.rbuf = self.rbuf[:i], self.rbuf[i+len(char):]
+                return line
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self.sock.settimeout(remaining)
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                return
+            finally:
+                self.sock.settimeout(None)
+            if not data:
+                # connection closed
+                return
+            self.rbuf += data
 
     def keyevent(self, key):
         res = self.send("press %s" % key)
@@ -76,40 +432,82 @@ class Monkey:
         return res == "OK"
 
     def sendtext(self, txt):
-        res = self.send("type %s" % txt)
+        res = self.send("type %s" % quotearg(txt))
         return res == "OK"
 
     def wake(self):
         res = self.send("wake", 1.0)
         return res == "OK"
 
-    def drag(self, frm, to, duration, steps):
+    def drag(self, frm, to, duration, steps, easing="linear", control=None, pacing="device"):
         """
                    #0        #1         #(steps-1)
         ---  down <dt> move <dt> move ... <dt> move <dt> up
         t:    t0                                         t0+dur
         x:    x0       x0+dx                    x1       x1
-        """
-        dx = (to[0]-frm[0]) / steps
-        dy = (to[1]-frm[1]) / steps
 
+        The moves follow `gesturepath`, with an optional easing function
+        and bezier control points, and are timed according to `pacing`,
+        see `playgesture`.
+        """
+        points = gesturepath(frm, to, steps, easing, control)
         dt = duration / (steps+1)
 
-        tstart = time.time()
-        tend = tstart + duration
+        events = [ (0, "down", points[0]) ]
+        events += [ (i*dt, "move", pos) for i, pos in enumerate(points[1:], 1) ]
+        events += [ (duration, "up", points[-1]) ]
 
-        pos = frm
-        self.touch("down", pos)
+        ok = self.playgesture(events, pacing)
+        self.lastdrag = (frm, to)
+        return ok
 
-        for _ in range(steps):
-            time.sleep(dt)
+    def fling(self, frm, to, duration=0.1, steps=5, pacing="device"):
+        """
+        A fast linear drag, released at full speed, without pausing at the end.
+        The fling velocity is determined by the distance and duration.
+        """
+        points = gesturepath(frm, to, steps)
+        dt = duration / steps
 
-            pos = (pos[0]+ dx, pos[1] + dy)
+        events = [ (i*dt, "move" if i else "down", pos) for i, pos in enumerate(points) ]
+        events += [ (duration, "up", points[-1]) ]
 
-            self.touch("move", pos)
+        ok = self.playgesture(events, pacing)
+        self.lastdrag = (frm, to)
+        return ok
+
+    def playgesture(self, events, pacing="device"):
+        """
+        Sends a list of (time, how, pos) touch events, with time in seconds
+        from the start of the gesture.
 
-        time.sleep(dt)
-        self.touch("up", to)
+        With pacing="device", all events are sent at once, separated by
+        `sleep` commands, so the timing does not depend on the connection.
+        With pacing="host", each event is sent at its scheduled time, relative to
+        the start, so delays do not accumulate.
+
+        Returns True when all commands succeeded.
+        """
+        duration = events[-1][0] if events else 0
+        with self.batch(duration + 5.0) as b:
+            if pacing == "device":
+                sent = 0
+                for t, how, pos in events:
+                    ms = int(round(t * 1000))
+                    if ms > sent:
+                        b.sleep(ms - sent)
+                        sent = ms
+                    b.touch(how, pos)
+            elif pacing == "host":
+                tstart = time.monotonic()
+                for t, how, pos in events:
+                    delay = tstart + t - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    b.touch(how, pos)
+            else:
+                raise Exception("unknown pacing: %s" % pacing)
+        return b.ok()
 
     def touch(self, how, pos):
         res = self.send("touch %s %d %d" % (how, pos[0], pos[1]))
@@ -119,6 +517,60 @@ class Monkey:
         res = self.send("tap %d %d" % (pos[0], pos[1]))
         return res == "OK"
 
+    def deferred(self, event, timeout, cmd):
+        """
+        Execute `cmd`, the daemon answers only after `event` happened, or after
+        `timeout` seconds. The only event supported by monkey is "screenchange",
+        a window state change reported by the accessibility service.
+
+        Returns the response of `cmd`.
+        """
+        return self.send("deferreturn %s %d %s" % (event, int(timeout * 1000), cmd), timeout + 1.0)
+
+    def tapandwait(self, pos, timeout=1.0):
+        res = self.deferred("screenchange", timeout, "tap %d %d" % (pos[0], pos[1]))
+        return res == "OK"
+
+    def pressandwait(self, key, timeout=1.0):
+        res = self.deferred("screenchange", timeout, "press %s" % key)
+        return res == "OK"
+
+    def listviews(self):
+        """
+        returns the view ids declared by the application in the active window.
+        """
+        response = self.send("listviews", 2.0)
+        if not response or not response.startswith('OK:'):
+            return
+        return response[3:].split()
+
+    def getrootview(self):
+        """
+        returns the (windowid, viewid) accessibility ids of the root view of the active window.
+        """
+        response = self.send("getrootview")
+        if not response or not response.startswith('OK:'):
+            return
+        ids = parseids(response[3:])
+        if ids:
+            return ids[0]
+
+    def getviewswithtext(self, text):
+        """
+        returns a list of (windowid, viewid) of the views containing `text`.
+        """
+        response = self.send("getviewswithtext %s" % quotearg(text), 2.0)
+        if not response or not response.startswith('OK:'):
+            return
+        return parseids(response[3:])
+
+    def queryview(self, view, cmd):
+        """
+        Execute a view command, `view` is either "viewid <id>", or "accessibilityids <windowid> <viewid>".
+        returns the result string, or None for errors.
+        """
+        return okvalue(self.send("queryview %s %s" % (view, cmd)))
+
     def listvar(self):
         response = self.send("listvar")
         if not response.startswith('OK:'):
@@ -132,13 +584,31 @@ class Monkey:
             return
         return response[3:]
 
+    def close(self):
+        self.sock.close()
+
     @staticmethod
-    def launchmonkey(adb):
+    def probe(port, timeout=0.5):
         """
-        returns a Monkey object
+        returns a Monkey object when a responsive monkey daemon is listening
+        on the local `port`, None otherwise.
         """
-        print("fwd->", adb.forward(12345, 12345))
+        try:
+            mon = Monkey(port)
+        except socket.error:
+            return
+        try:
+            if mon.send("wake", timeout) == "OK":
+                return mon
+        except socket.error:
+            pass
+        mon.close()
 
+    @staticmethod
+    def killmonkey(adb):
+        """
+        kill any monkey process running on the device.
+        """
         # or 'toybox killall'
         killres = adb.shell("killall -v com.android.commands.monkey") # use -v to report signal result
         if killres and bool(re.search(r"killall:.*not found", killres)):
@@ -151,57 +621,79 @@ class Monkey:
             else:
                 killres = 'process not found'
         # todo - when killres is None, the 'killall' probably was never executed.
-        print("kill->", killres)
-        time.sleep(0.1)
-        monkeycmd = adb.makeshell("monkey -v --script-log --port 12345")
+        return killres
+
+    @staticmethod
+    def launchmonkey(adb, port=12345, timeout=10.0):
+        """
+        returns a Monkey object
 
-        if not Monkey.wait_for_monkey(monkeycmd):
+        The port is forwarded to this device first, replacing a forward to
+        another device, then a monkey daemon which is still running from a
+        previous session is reused. Otherwise the old monkey is killed, and
+        a new one is started.
+        """
+        adb.forward(port, port)
+
+        mon = Monkey.probe(port)
+        if mon:
+            print("monkey active")
+            return mon
+
+        print("kill->", Monkey.killmonkey(adb))
+        for _ in range(2):
+            monkeycmd = adb.makeshell("monkey -v --script-log --port %d" % port)
+            if Monkey.wait_for_monkey(monkeycmd, timeout):
+                break
+            # maybe the old monkey did not release the port yet.
+            monkeycmd.close()
+            monkeycmd = None
+            time.sleep(0.2)
+
+        if not monkeycmd:
             print("Failed to start monkey")
             return
         print("monkey active")
 
-        for _ in range(4):
-            mon = Monkey(12345)
-            try:
-                if mon.wake():
-                    break
-            except Exception as e:
-                print("trying -> %s" % e)
-                import traceback
-                traceback.print_exc()
+        # monkey reports its start before it listens on the port.
+        deadline = time.monotonic() + 5.0
+        while True:
+            mon = Monkey.probe(port)
+            if mon or time.monotonic() >= deadline:
+                break
+            time.sleep(0.05)
 
-            mon = None
-            time.sleep(0.5)
+        monkeycmd.close()
 
         if not mon:
             print("could not connect to Monkey")
             return
 
-        monkeycmd.close()
-
         return mon
 
     @staticmethod
-    def wait_for_monkey(monkeycmd):
+    def wait_for_monkey(monkeycmd, timeout=10.0):
         """
         wait until the monkey tool has launched without an error.
+        Returns as soon as the monkey output shows it started.
         """
-        tstart = time.time()
-        tend = tstart + 10.0
+        deadline = time.monotonic() + timeout
 
         print("=== waiting for monkey")
-        while time.time() < tend:
+        output = ""
+        while time.monotonic() < deadline:
+            # blocks until output is available, or for at most 0.5 seconds.
             resp = monkeycmd.read()
+            if resp == "":
+                # the shell exited without starting monkey, like for 'monkey: not found'.
+                break
             if resp:
                 print("monkeycmd -> ", resp)
-                if resp.find('Error') >= 0:
+                output += resp
+                if output.find('Error') >= 0:
                     return
-                if resp.find(":Monkey:")>=0:
+                if output.find(":Monkey:")>=0:
                     print()
                     return True
-
-            time.sleep(0.5)
         print()
 
-
-
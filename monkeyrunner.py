@@ -10,11 +10,14 @@ which connect to respectively monkey.jar and the ADB Daemon.
 """
 import time
 import re
-import sys
+import base64
 import PIL.Image
-import PIL.ImageChops
+import numpy
+import imagelib
 from adblib import ADB
-from monkeylib import Monkey
+from monkeylib import Monkey, MonkeyScript, okvalue, parseids, quotearg, splitcommand
+from proplib import PropertyCache
+from hierarchylib import dumphierarchy
 
 
 def center(msg, width):
@@ -194,10 +197,136 @@ class MonkeyDevice:
     MOVE = "move"
     UP = "up"
 
+    # with ADBKeyboard, text of this length is broadcast in one go, shorter text is typed
+    # by monkey, as the broadcast has a fixed startup cost.
+    BROADCAST_MINLEN = 32
+    ADBKEYBOARD_IME = "com.android.adbkeyboard/.AdbIME"
+    # the number of characters passed to one 'input text' command.
+    INPUT_TEXT_CHUNK = 200
+    # seconds after which cached views are queried again, even without input.
+    VIEW_TTL = 1.0
+
     def __init__(self, adb, mlib):
         self.adb = adb
         self.mlib = mlib
 
+        # time.monotonic() of the last input event sent to the device.
+        self.lastinput = 0.0
+
+        # cached monkey variables and system properties.
+        self.properties = PropertyCache(adb, mlib)
+
+        # the selected input method, queried when first needed.
+        self._ime = None
+
+        # MonkeyViews, and view lookups, for the current window.
+        self._views = {}
+        self._viewInput = None      # lastinput when the views were cached
+        self._viewTime = 0.0        # time.monotonic() when the views were cached
+        self._viewWindow = None     # window id of the cached views
+        self._viewGen = 0
+
+    def _viewGeneration(self):
+        """
+        returns a number which changes each time the cached views are discarded,
+        this happens when input was sent to the device, the active window changed,
+        or after VIEW_TTL seconds, as the app can change its views by itself.
+        """
+        if self._viewInput != self.lastinput or time.monotonic() - self._viewTime > self.VIEW_TTL:
+            self._clearViews()
+        return self._viewGen
+
+    def _clearViews(self):
+        self._views = {}
+        self._viewInput = self.lastinput
+        self._viewTime = time.monotonic()
+        self._viewGen += 1
+
+    def _setWindow(self, rootIds):
+        """
+        Record the window of the root view, as returned by getrootview.
+        """
+        if rootIds and rootIds[0][0] != self._viewWindow:
+            self._viewWindow = rootIds[0][0]
+            self._clearViews()
+
+    def _view(self, query):
+        self._viewGeneration()
+        view = self._views.get(query)
+        if view is None:
+            view = self._views[query] = MonkeyView(self, query)
+        return view
+
+    def _viewsByIds(self, ids):
+        return [ self._view("accessibilityids %d %d" % _) for _ in ids ]
+
+    def _windowQuery(self, key, query):
+        """
+        Execute a query on the active window, together with getrootview, to
+        detect window changes. The result is cached until the views are discarded.
+        Without `query`, this returns the getrootview result.
+        """
+        self._viewGeneration()
+        if key not in self._views:
+            with self.mlib.batch() as b:
+                root = b.getrootview()
+                fut = query(b) if query else root
+            self._setWindow(parseids(okvalue(root.response) or ""))
+            self._views[key] = okvalue(fut.response)
+        return self._views[key]
+
+    def _inputMethod(self):
+        if self._ime is None:
+            self._ime = self.adb.runshell("settings get secure default_input_method").strip()
+        return self._ime
+
+    def _typeMethod(self, text):
+        """
+        Choose the fastest way of entering `text`:
+          broadcast - the whole text at once, this needs the ADBKeyboard input method
+                      to be selected. Used for long text, and for characters the
+                      other methods can't type.
+          monkey - the printable ascii text the monkey command parser passes unchanged.
+          input - the 'input text' shell command, for other printable ascii, like
+                  runs of spaces. Like monkey, this injects one key event per
+                  character, but it also starts a new process.
+        An exception is raised for non-ascii text without ADBKeyboard.
+        """
+        nonascii = re.search(r'[^\x20-\x7e]', text)
+        typable = splitcommand("type " + quotearg(text)) == ["type", text]
+        if nonascii or not typable or len(text) >= self.BROADCAST_MINLEN:
+            if self._inputMethod() == self.ADBKEYBOARD_IME:
+                return "broadcast"
+        if nonascii:
+            ime, self._ime = self._inputMethod(), None   # query again after the input method was changed.
+            raise Exception("typing non-ascii text needs the ADBKeyboard input method, current is: %s" % ime)
+        if typable:
+            return "monkey"
+        return "input"
+
+    def _typeWithInput(self, text):
+        """
+        The text is single quoted for the shell, spaces are passed as '%s'.
+        'input text' always turns '%s' into a space, so a literal '%s' is split
+        over two commands, ending in '%' and starting with 's'.
+        Long text is split in several commands, executed in one shell.
+        """
+        parts = text.split("%s")
+        cmds = []
+        for i, part in enumerate(parts):
+            if i > 0:
+                part = "s" + part
+            if i < len(parts) - 1:
+                part += "%"
+            for j in range(0, len(part), self.INPUT_TEXT_CHUNK):
+                chunk = part[j:j+self.INPUT_TEXT_CHUNK].replace(" ", "%s").replace("'", "'\\''")
+                cmds.append("input text '%s'" % chunk)
+        self.adb.runshell(" && ".join(cmds))
+
+    def _typeWithBroadcast(self, text):
+        msg = base64.b64encode(text.encode('utf-8')).decode('ascii')
+        self.adb.runshell("am broadcast -a ADB_INPUT_B64 --es msg %s" % msg)
+
     def broadcastIntent(self, uri=None, action=None, data=None, mimetype=None, categories=None, extras=None, component=None, flags=0):
         """
         Sends a broadcast intent to the device.
@@ -264,7 +393,7 @@ class MonkeyDevice:
 
         return " ".join(quotespaces(_) for _ in args)
 
-    def drag(self, start, end, duration=1.0, steps=10):
+    def drag(self, start, end, duration=1.0, steps=10, easing="linear", control=None, pacing="device"):
         """
         Simulates dragging (touch, hold, and move) on the device screen.
 
@@ -274,8 +403,28 @@ class MonkeyDevice:
             duration - Duration of the drag in seconds (default is 1.0 seconds)
             steps - The number of steps to take when interpolating points. (default is 
                     10)
+            easing - Optional: "linear", "ease", "easein", "easeout", or a function
+                     mapping the fraction of time to the fraction of the path.
+            control - Optional list of bezier control points, for a curved path.
+            pacing - "device" to let monkey time the steps, "host" to time them here.
+        """
+        self.mlib.drag(start, end, duration, steps, easing, control, pacing)
+        self.lastinput = time.monotonic()
+
+    def fling(self, start, end, duration=0.1, steps=5, pacing="device"):
         """
-        self.mlib.drag(start, end, duration, steps)
+        A fast drag, released without stopping, so lists keep scrolling.
+        The same parameters give the same fling velocity each time.
+
+          Args:
+            start - The starting point (a tuple (x,y) in pixels)
+            end - The point where the touch is released (a tuple (x,y) in pixels)
+            duration - Duration of the movement in seconds
+            steps - The number of move events.
+            pacing - "device" to let monkey time the steps, "host" to time them here.
+        """
+        self.mlib.fling(start, end, duration, steps, pacing)
+        self.lastinput = time.monotonic()
 
     def getHierarchyViewer(self):
         """
@@ -290,20 +439,24 @@ class MonkeyDevice:
           Args:
             key - The name of the variable. The available names are listed in
                   http://developer.android.com/guide/topics/testing/monkeyrunner.html.
+
+        All properties are fetched at once, and cached, see proplib.PropertyCache.
         """
-        return self.mlib.getvar(key)
+        return self.properties.get(key)
 
     def getPropertyList(self):
         """
         Retrieve the properties that can be queried
         """
-        return self.mlib.listvar()
+        return self.properties.names()
 
     def getRootView(self):
         """
         Obtains current root view
         """
-        # todo
+        ids = parseids(self._windowQuery("getrootview", None) or "")
+        if ids:
+            return self._viewsByIds(ids)[0]
 
     def getSystemProperty(self, key):
         """
@@ -311,8 +464,11 @@ class MonkeyDevice:
 
           Args:
             key - The name of the system variable.
+
+        Besides the monkey variables, this also returns the android system properties,
+        as listed by `getprop`.
         """
-        self.getProperty(key)
+        return self.properties.get(key)
 
     def getViewByAccessibilityIds(self, windowId, accessibilityId ):
         """
@@ -322,7 +478,7 @@ class MonkeyDevice:
             windowId - The window id of the view to retrieve.
             accessibilityId - The accessibility id of the view to retrieve.
         """
-        # todo
+        return self._view("accessibilityids %d %d" % (windowId, accessibilityId))
 
     def getViewById(self, id):
         """
@@ -330,14 +486,18 @@ class MonkeyDevice:
 
           Args:
             id - The id of the view to retrieve.
+
+        The view is not queried until one of its methods is called.
         """
-        # todo
+        return self._view("viewid %s" % id)
 
     def getViewIdList(self):
         """
         Retrieve the view ids for the current application
         """
-        # todo
+        ids = self._windowQuery("listviews", lambda b: b.listviews())
+        if ids is not None:
+            return ids.split()
 
     def getViewsByText(self, text):
         """
@@ -346,7 +506,9 @@ class MonkeyDevice:
           Args:
             text - The text to search for
         """
-        # todo
+        ids = self._windowQuery(("text", text), lambda b: b.getviewswithtext(text))
+        if ids is not None:
+            return self._viewsByIds(parseids(ids))
 
     def installPackage(self, path):
         """
@@ -403,6 +565,20 @@ class MonkeyDevice:
             self.mlib.keyevent(name)
         else:
             self.mlib.key(type, name)
+        self.lastinput = time.monotonic()
+
+    def pressAndWait(self, name, timeout=1.0):
+        """
+        Press a key, and return when the screen changed, or the timeout expired.
+        The waiting is done by the monkey daemon, in the same round trip.
+
+          Args:
+            name - the keycode of the key to press (see android.view.KeyEvent)
+            timeout - The maximum time to wait, in seconds.
+        """
+        res = self.mlib.pressandwait(name, timeout)
+        self.lastinput = time.monotonic()
+        return res
 
     def reboot(self, into=None):
         """
@@ -412,6 +588,21 @@ class MonkeyDevice:
             into - the bootloader to reboot into: bootloader, recovery, or None
         """
         self.adb.reboot(into)
+        self.properties.invalidate()
+        self._ime = None
+
+    def recordMacro(self):
+        """
+        Returns a MonkeyMacro, recording touch, press, drag, type and sleep calls,
+        to be executed on the device by runMacro.
+        """
+        return MonkeyMacro()
+
+    def refreshViews(self):
+        """
+        Discard the cached views, the next view lookup or attribute is queried again.
+        """
+        self._clearViews()
 
     def removePackage(self, package):
         """
@@ -424,6 +615,22 @@ class MonkeyDevice:
         self.adb.shell("pm uninstall " + package)
         # todo: return result.
 
+    def runMacro(self, macro, timeout=None):
+        """
+        Upload a recorded macro as a monkey script, and let monkey execute it on the device.
+        The timing of the events does not depend on the connection to the device.
+
+        Returns the monkey log, or None when the script did not finish in time.
+
+          Args:
+            macro - The MonkeyMacro returned by recordMacro.
+            timeout - The maximum time to wait, in seconds, by default the time
+                      the macro sleeps, plus 30 seconds.
+        """
+        log = macro.script.run(self.adb, timeout=timeout)
+        self.lastinput = time.monotonic()
+        return log
+
     def shell(self, cmd, timeout=0):
         """
         Executes an adb shell command and returns the result, if any.
@@ -444,7 +651,21 @@ class MonkeyDevice:
         display.
         """
         cap = self.adb.makecapture()
-        return MonkeyImage(cap.capture())
+        return MonkeyImage.fromBuffer(cap.captureraw(), (cap.width, cap.height), cap.rawmode)
+
+    def tapAndWait(self, x, y, timeout=1.0):
+        """
+        Tap the screen, and return when the screen changed, or the timeout expired.
+        The waiting is done by the monkey daemon, in the same round trip.
+
+          Args:
+            x - x coordinate in pixels
+            y - y coordinate in pixels
+            timeout - The maximum time to wait, in seconds.
+        """
+        res = self.mlib.tapandwait((x, y), timeout)
+        self.lastinput = time.monotonic()
+        return res
 
     def touch(self, x, y, type):
         """
@@ -459,16 +680,135 @@ class MonkeyDevice:
             self.mlib.tap((x, y))
         else:
             self.mlib.touch(type, (x, y))
+        self.lastinput = time.monotonic()
 
-    def type(self, message):
+    def type(self, message, method=None):
         """
         Types the specified string on the keyboard. This is equivalent to calling press
         (keycode,DOWN_AND_UP) for each character in the string.
 
+        Newlines are sent as KEYCODE_ENTER, the other text is typed by monkey, or
+        broadcast to the ADBKeyboard input method when that is selected, see _typeMethod.
+
           Args:
             message - The string to send to the keyboard.
-        """
-        self.mlib.sendtext(message)
+            method - Optional: force "monkey", "input" or "broadcast".
+        """
+        for i, line in enumerate(message.split("\n")):
+            if i:
+                self.mlib.keyevent("KEYCODE_ENTER")
+            if not line:
+                continue
+            how = method or self._typeMethod(line)
+            if how == "monkey":
+                self.mlib.sendtext(line)
+            elif how == "input":
+                self._typeWithInput(line)
+            elif how == "broadcast":
+                self._typeWithBroadcast(line)
+            else:
+                raise Exception("unknown type method: %s" % how)
+        self.lastinput = time.monotonic()
+
+    def waitFor(self, predicate, timeout=30.0, mininterval=0.05, maxinterval=1.0):
+        """
+        Take snapshots until a predicate is true, or the timeout expires.
+
+        Each snapshot is compared with the previous one, predicates are only evaluated
+        again when the screen changed. The poll interval starts at `mininterval`, and
+        grows while the screen does not change, up to `maxinterval`. It is reset when the
+        screen changes, or when input was sent to the device.
+
+        Returns the result of the predicate, or for a dict of predicates, the name of
+        the first one which is true. Returns None when the timeout expired.
+
+          Args:
+            predicate - A function taking a MonkeyImage, or a dict of named functions,
+                        all evaluated on the same snapshot.
+            timeout - The maximum time to wait, in seconds.
+            mininterval - The shortest time between snapshots, in seconds.
+            maxinterval - The longest time between snapshots, in seconds.
+        """
+        if callable(predicate):
+            predicates = [ (None, predicate) ]
+        else:
+            predicates = list(predicate.items())
+
+        deadline = time.monotonic() + timeout
+        interval = mininterval
+        previous = None
+        polltime = time.monotonic()
+        while True:
+            lastpoll, polltime = polltime, time.monotonic()
+            frame = self.takeSnapshot()
+            if previous is None or not frame.sameAs(previous):
+                for name, check in predicates:
+                    result = check(frame)
+                    if result:
+                        return result if name is None else name
+                interval = mininterval
+            elif self.lastinput >= lastpoll:
+                interval = mininterval
+            else:
+                interval = min(maxinterval, interval * 1.5)
+            previous = frame
+
+            now = time.monotonic()
+            if now >= deadline:
+                return
+            time.sleep(max(0, min(polltime + interval, deadline) - now))
+
+    def waitForIdle(self, region=None, stableFrames=3, timeout=10.0, tolerance=0, interval=0.0):
+        """
+        Wait until the screen stops changing, for example after an animation
+        started by a tap. Snapshots are taken continuously, and compared with the
+        previous snapshot, only decoding the pixels in the region.
+
+        Returns the last snapshot when the screen was stable, or None when
+        the timeout expired.
+
+          Args:
+            region - Optional tuple (x, y, w, h), only this part of the screen needs
+                     to be stable.
+            stableFrames - The number of consecutive snapshots without changes.
+            timeout - The maximum time to wait, in seconds.
+            tolerance - The per channel tolerance, see sameAs.
+            interval - Optional extra time between snapshots, in seconds.
+        """
+        deadline = time.monotonic() + timeout
+        previous = None
+        stable = 0
+        while time.monotonic() < deadline:
+            frame = self.takeSnapshot()
+            if previous is not None and frame.sameAs(previous, tolerance=tolerance, region=region):
+                stable += 1
+                if stable >= stableFrames:
+                    return frame
+            else:
+                stable = 0
+            previous = frame
+            if interval:
+                time.sleep(interval)
+
+    def waitForImage(self, reference, region=None, timeout=30.0, percent=1.0, tolerance=0):
+        """
+        Wait until (a part of) the screen looks like a reference image.
+
+        Returns True when the screen matched, None when the timeout expired.
+
+          Args:
+            reference - The MonkeyImage to wait for. This is either a full screen image,
+                        or an image with the size of the region.
+            region - Optional tuple (x, y, w, h) of the part of the screen to compare.
+            timeout - The maximum time to wait, in seconds.
+            percent - The fraction of pixels which need to be the same, see sameAs.
+            tolerance - The per channel tolerance, see sameAs.
+        """
+        def matches(frame):
+            if region and reference.size == tuple(region[2:]):
+                return frame.getSubImage(region).sameAs(reference, percent, tolerance)
+            return frame.sameAs(reference, percent, tolerance, region=region)
+        return self.waitFor(matches, timeout)
 
     def wake(self):
         """
@@ -478,6 +818,61 @@ class MonkeyDevice:
 
 # -- end of MonkeyDevice --
 
+class MonkeyMacro:
+    """
+    Records MonkeyDevice input calls into a monkey script.
+    Obtained from MonkeyDevice.recordMacro.
+
+        macro = device.recordMacro()
+        macro.touch(100, 200, MonkeyDevice.DOWN_AND_UP)
+        macro.sleep(0.5)
+        macro.press("KEYCODE_BACK", MonkeyDevice.DOWN_AND_UP)
+        print(device.runMacro(macro))
+    """
+    def __init__(self):
+        self.script = MonkeyScript()
+
+    def drag(self, start, end, duration=1.0, steps=10, easing="linear", control=None):
+        """
+        see MonkeyDevice.drag
+        """
+        self.script.drag(start, end, duration, steps, easing, control)
+
+    def press(self, name, type=MonkeyDevice.DOWN_AND_UP):
+        """
+        see MonkeyDevice.press, DOWN and UP events need a numeric keycode.
+        """
+        if type == MonkeyDevice.DOWN_AND_UP:
+            self.script.keyevent(name)
+        else:
+            self.script.key(type, name)
+
+    def sleep(self, seconds):
+        """
+        Let the device pause between events.
+
+          Args:
+            seconds - The time to pause, in seconds.
+        """
+        self.script.sleep(seconds * 1000)
+
+    def touch(self, x, y, type):
+        """
+        see MonkeyDevice.touch
+        """
+        if type == MonkeyDevice.DOWN_AND_UP:
+            self.script.tap((x, y))
+        else:
+            self.script.touch(type, (x, y))
+
+    def type(self, message):
+        """
+        see MonkeyDevice.type
+        """
+        self.script.sendtext(message)
+
+# -- end of MonkeyMacro --
+
 class MonkeyImage:
     """
     An image
@@ -487,10 +882,215 @@ class MonkeyImage:
         """
         Takes a Pillow.Image object
         """
-        self.img = img
+        self._img = img
+        self._raw = None        # (data, rawmode) of an undecoded capture
+        self._rawsize = None    # size of the capture, this image can be a part of it
+        self._origin = (0, 0)   # position of this image in the capture
+        self.size = img.size if img is not None else None
+        self._clearcache()
+
+    @staticmethod
+    def fromBuffer(data, size, rawmode):
+        """
+        Create a MonkeyImage from an undecoded framebuffer capture,
+        the pixels are only decoded when they are accessed.
+
+          Args:
+            data - The raw pixel data.
+            size - A tuple (w, h) with the image size in pixels.
+            rawmode - The PIL rawmode describing the pixel format, like "RGBA" or "RGB;16".
+        """
+        img = MonkeyImage(None)
+        img._raw = (data, rawmode)
+        img.size = img._rawsize = tuple(size)
+        return img
 
+    @staticmethod
+    def _rawImageMode(rawmode):
+        """
+        The PIL image mode for a framebuffer rawmode, the same as ADBFrameCapture uses.
+        """
+        return "RGBA" if rawmode in ("RGBA", "BGRA") else "RGB"
+
+    def _clearcache(self):
+        # only captures are cached, a Pillow image can be changed through `img`.
+        self._array = None
+        self._planes = {}
+        self._integrals = {}
+        self._grays = None
+        self._templates = {}
+
+    @property
+    def img(self):
+        """
+        The Pillow.Image object, decoded when first used.
+        Changes to it are seen by all methods: from then on, a capture, or sub
+        image of a capture, no longer uses the capture buffer, or cached results.
+        """
+        if self._raw:
+            self._img = self._decoded()
+            self._raw = self._rawsize = None
+            self._origin = (0, 0)
+            self._clearcache()
+        return self._img
+
+    @img.setter
+    def img(self, img):
+        self._img = img
+        self._raw = self._rawsize = None
+        self._origin = (0, 0)
+        self.size = img.size
+        self._clearcache()
+
+    def _decoded(self):
+        """
+        Returns a Pillow image with the pixels, without handing out `img`.
+        """
+        if self._raw is None:
+            return self._img
+        data, rawmode = self._raw
+        mode = MonkeyImage._rawImageMode(rawmode)
+        if self.size == self._rawsize:
+            return PIL.Image.frombytes(mode, self.size, data, "raw", rawmode)
+        pixels = self._pixels() if mode == "RGBA" else self._pixels()[:, :, :3]
+        return PIL.Image.fromarray(numpy.ascontiguousarray(pixels), mode)
+
+    def _pixels(self):
+        """
+        Returns the image as a (height, width, 4) numpy RGBA array.
+        For captures the array is computed once, and cached, in RGBA format
+        it is a read-only view of the capture buffer.
+        """
+        if self._raw is None:
+            return imagelib.toarray(self._img)
+        if self._array is None:
+            self._array = self._region((0, 0, self.size[0], self.size[1]))
+        return self._array
+
+    def _region(self, rect):
+        """
+        Returns the RGBA pixels of a part of the image, only decoding that part
+        when the capture was not decoded yet.
+        """
+        x0, y0, x1, y1 = imagelib.cliprect(rect, self.size[0], self.size[1])
+        if self._raw is None:
+            return imagelib.toarray(self._img.crop((x0, y0, x1, y1)))
+        if self._array is not None:
+            return self._array[y0:y1, x0:x1]
+        data, rawmode = self._raw
+        x, y = self._origin
+        return imagelib.rawarray(data, self._rawsize, rawmode, (x + x0, y + y0, x1 - x0, y1 - y0))
+
+    def _rgba(self, x, y):
+        """
+        Returns the (r, g, b, a) value of a single pixel.
+        """
+        if not (0 <= x < self.size[0] and 0 <= y < self.size[1]):
+            raise IndexError("image index out of range")
+        if self._raw:
+            data, rawmode = self._raw
+            return imagelib.rawpixel(data, self._rawsize[0], rawmode, x + self._origin[0], y + self._origin[1])
+        px = self._img.getpixel((x, y))
+        if len(px) == 3:
+            px += (255,)
+        return px
+
+    def _quantized(self, bits):
+        """
+        Returns the packed quantized color plane of the image.
+        The plane is computed once per number of bits, and cached.
+        """
+        bits = imagelib.channelbits(bits)
+        plane = self._planes.get(bits)
+        if plane is None:
+            plane = imagelib.quantize(self._pixels(), bits)
+            if self._raw:
+                self._planes[bits] = plane
+        return plane
+
+    def _pyramid(self, levels):
+        """
+        Returns the grayscale image pyramid, with at least `levels` levels
+        below the full resolution image.
+        """
+        grays = self._grays
+        if grays is None:
+            grays = [ imagelib.grayscale(self._pixels()) ]
+            if self._raw:
+                self._grays = grays
+        while len(grays) <= levels:
+            grays.append(imagelib.downsample(grays[-1]))
+        return grays
+
+    def _templatePyramid(self, scale):
+        """
+        Returns the TemplatePyramid for this image used as a template,
+        resized by `scale`. The pyramids are cached.
+        """
+        tpyr = self._templates.get(scale)
+        if tpyr is None:
+            g = self._pyramid(0)[0]
+            if scale != 1.0:
+                size = (max(1, int(round(g.shape[1] * scale))), max(1, int(round(g.shape[0] * scale))))
+                g = numpy.asarray(PIL.Image.fromarray(g, "F").resize(size, PIL.Image.BILINEAR))
+            tpyr = imagelib.TemplatePyramid(g, imagelib.pyramidlevels(g.shape[::-1]))
+            if self._raw:
+                self._templates[scale] = tpyr
+        return tpyr
+
+    def _comparable(self, other, mask, region):
+        """
+        Returns the pixel arrays of self and other, and the mask,
+        restricted to the region being compared. Only the region is decoded.
+        """
+        width, height = min(self.size[0], other.size[0]), min(self.size[1], other.size[1])
+        x0, y0, x1, y1 = imagelib.cliprect(region, width, height)
+        rect = (x0, y0, x1 - x0, y1 - y0)
+        if mask is not None:
+            if isinstance(mask, MonkeyImage):
+                mask = mask._region(rect)[:, :, :3].any(axis=2)
+            else:
+                mask = numpy.asarray(mask, dtype=bool)[y0:y1, x0:x1]
+        return self._region(rect), other._region(rect), mask
+
+    def _select(self, points, rect):
+        """
+        Returns the RGBA values of a list of points, or of a rectangle.
+        Only the rectangle, or the bounding box of the points, is decoded.
+        """
+        if rect is not None:
+            x, y, w, h = rect
+            if x < 0 or y < 0 or x + w > self.size[0] or y + h > self.size[1]:
+                raise IndexError("rectangle outside of image")
+            return self._region(rect)
+        points = numpy.asarray(points, dtype=numpy.intp).reshape(-1, 2)
+        if ((points < 0) | (points >= self.size)).any():
+            raise IndexError("image index out of range")
+        if not len(points):
+            return numpy.zeros((0, 4), dtype=numpy.uint8)
+        x0, y0 = points.min(axis=0)
+        x1, y1 = points.max(axis=0) + 1
+        a = self._region((x0, y0, x1 - x0, y1 - y0))
+        return a[points[:, 1] - y0, points[:, 0] - x0]
 
-    def convertToBytes(self, format="png"):
+    @staticmethod
+    def convertManyToBytes(images, format="png", level=None, quality=None, workers=None):
+        """
+        Convert a list of MonkeyImages, using a pool of threads. Returns a list with
+        the encoded images, in the same order.
+
+          Args:
+            images - The list of MonkeyImage objects.
+            format - The destination format, see convertToBytes.
+            level - The compression effort, see convertToBytes.
+            quality - The quality for the lossy formats, from 1 to 100.
+            workers - The number of threads to use, defaults to the number of cpus.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(workers) as pool:
+            return list(pool.map(lambda img: img.convertToBytes(format, level, quality), images))
+
+    def convertToBytes(self, format="png", level=None, quality=None):
         """
         Converts the MonkeyImage into a particular format and returns the result as a 
         String. Use this to get access to the rawpixels in a particular format. String 
@@ -498,9 +1098,98 @@ class MonkeyImage:
 
           Args:
             format - The destination format (for example, 'png' for Portable Network 
-                     Graphics format). The default is png.
+                     Graphics format). The default is png. Supported are: png, jpeg, webp,
+                     and raw, for the RGBA pixels.
+            level - "fastest", or the compression effort, from 0 (fast, large) to 9 (slow,
+                    small). The default is the encoder's default.
+            quality - The quality for the lossy formats, from 1 to 100.
+        """
+        if format == "raw":
+            if self._raw and self.size == self._rawsize and self._raw[1] == "RGBA":
+                return self._raw[0]
+            return numpy.ascontiguousarray(self._pixels()).tobytes()
+        return imagelib.encode(self._decoded(), format, level, quality)
+
+    def countColors(self, rect, codes, bits=3):
         """
-        return self.img.tobytes(encoder_name=format)
+        Count the pixels in a region with one of the specified quantized colors.
+
+          Args:
+            rect - A tuple (x, y, w, h) describing the region to examine,
+                   or None for the whole image.
+            codes - A color code, or a list of color codes. A color code is either
+                    an integer, a string with a hex digit per channel, like "350",
+                    or a tuple (r, g, b) of quantized channel values, like (3, 5, 0).
+            bits - The number of most significant bits kept of each channel, or a
+                   tuple (rbits, gbits, bbits).
+        """
+        if isinstance(codes, (str, int, tuple)):
+            codes = [codes]
+        codes = [imagelib.colorcode(_, bits) for _ in codes]
+        plane = self._quantized(bits)
+        x0, y0, x1, y1 = imagelib.cliprect(rect, plane.shape[1], plane.shape[0])
+        return int(numpy.count_nonzero(numpy.isin(plane[y0:y1, x0:x1], codes)))
+
+    def diffTiles(self, other, tilesize=64, tolerance=0, region=None):
+        """
+        Compare with another image of the same size, in square tiles.
+
+        Returns a boolean numpy array with a value for each tile, true when the tile
+        contains pixels which differ, the tile at row r, column c covers the pixels
+        (c * tilesize, r * tilesize) .. ((c+1) * tilesize, (r+1) * tilesize),
+        relative to the top left corner of the region.
+
+          Args:
+            other - The other MonkeyImage object.
+            tilesize - The width and height of the tiles, in pixels.
+            tolerance - The maximum difference per channel for pixels to be considered
+                        the same, either a single value or a (r, g, b, a) tuple.
+            region - Optional tuple (x, y, w, h) limiting the comparison to a
+                     part of the image.
+        """
+        if self.size != other.size:
+            raise Exception("image sizes differ")
+        return imagelib.difftiles(self._region(region), other._region(region), tilesize, tolerance)
+
+    def findDenseRegions(self, colorPredicate, window, threshold, stride=None, region=None, bits=3, distinct=False):
+        """
+        Find the regions containing more than `threshold` pixels matching
+        `colorPredicate`. This uses a summed-area table, so any window size
+        can be evaluated at constant cost per window.
+
+        Returns a list of (MonkeyRect, count) tuples, the densest region first.
+
+          Args:
+            colorPredicate - Either a color code or list of color codes, as used by
+                             countColors, or a function taking a (height, width, 4)
+                             numpy RGBA array, and returning a boolean array of the
+                             matching pixels.
+            window - A tuple (w, h) with the size of the region to count.
+            threshold - Only regions with more than this number of matching pixels
+                        are returned.
+            stride - A tuple (sx, sy) with the spacing between the evaluated windows.
+                     Defaults to half the window size.
+            region - Optional tuple (x, y, w, h) limiting the search to a part of
+                     the image.
+            bits - The quantization used for color codes.
+            distinct - When true, regions overlapping a denser region are dropped.
+        """
+        if callable(colorPredicate):
+            sat = imagelib.integral(colorPredicate(self._pixels()))
+        else:
+            if isinstance(colorPredicate, (str, int, tuple)):
+                colorPredicate = [colorPredicate]
+            bits = imagelib.channelbits(bits)
+            codes = tuple(sorted(set(imagelib.colorcode(_, bits) for _ in colorPredicate)))
+            sat = self._integrals.get((bits, codes))
+            if sat is None:
+                mask = numpy.isin(self._quantized(bits), codes)
+                sat = imagelib.integral(mask)
+                if self._raw:
+                    self._integrals[(bits, codes)] = sat
+        w, h = window
+        return [ (MonkeyRect(x, y, x + w, y + h), count)
+                for x, y, count in imagelib.densewindows(sat, window, threshold, stride, region, distinct) ]
 
     def getRawPixel(self, x, y):
         """
@@ -512,7 +1201,7 @@ class MonkeyImage:
             x - the x offset of the pixel
             y - the y offset of the pixel
         """
-        r, g, b, a = self.img.getpixel((x,y))
+        r, g, b, a = self._rgba(x, y)
 
         return a, r, g, b
 
@@ -526,57 +1215,176 @@ class MonkeyImage:
             x - the x offset of the pixel
             y - the y offset of the pixel
         """
-        r, g, b, _ = self.img.getpixel((x,y))
-        return int.from_bytes([b,g,r,255,255,255,255,255],byteorder=sys.byteorder, signed='True')
+        r, g, b, _ = self._rgba(x, y)
+        # same as a java int with alpha set to 0xff.
+        return ((0xff << 24) | (r << 16) | (g << 8) | b) - (1 << 32)
+
+    def getRawPixels(self, points=None, rect=None):
+        """
+        Get the ARGB (alpha, red, green, blue) pixels at a list of locations, or
+        in a rectangle, in one call.
+
+        Returns a numpy uint8 array, of shape (N, 4) for a list of points, or
+        (h, w, 4) for a rectangle.
+
+          Args:
+            points - A list of (x, y) tuples, or a (N, 2) numpy array of coordinates.
+            rect - A tuple (x, y, w, h) describing a region.
+        """
+        return imagelib.argb(self._select(points, rect))
+
+    def getRawPixelsInt(self, points=None, rect=None):
+        """
+        Get the ARGB pixels at a list of locations, or in a rectangle, as
+        integers, with the same values as returned by getRawPixelInt.
+
+        Returns a numpy int32 array, of shape (N,) for a list of points, or
+        (h, w) for a rectangle.
+
+          Args:
+            points - A list of (x, y) tuples, or a (N, 2) numpy array of coordinates.
+            rect - A tuple (x, y, w, h) describing a region.
+        """
+        return imagelib.packargb(self._select(points, rect))
 
     def getSubImage(self, rect):
         """
         Copy a rectangular region of the image.
 
+        A sub image of a capture shares the capture buffer, the pixels are only
+        copied when the sub image's `img` is used.
+
           Args:
             rect - A tuple (x, y, w, h) describing the region to copy. x and y specify 
                    upper lefthand corner of the region. w is the width of the region 
                    in pixels, and h is its height.
         """
         (x, y, w, h) = rect
-        return MonkeyImage(self.img.crop( (x, y, x+w, y+h) ))
+        if not self._raw or x < 0 or y < 0 or w <= 0 or h <= 0 or x + w > self.size[0] or y + h > self.size[1]:
+            # crop pads the parts outside the image.
+            return MonkeyImage(self._decoded().crop( (x, y, x+w, y+h) ))
+        sub = MonkeyImage(None)
+        sub._raw, sub._rawsize = self._raw, self._rawsize
+        sub._origin = (self._origin[0] + x, self._origin[1] + y)
+        sub.size = (w, h)
+        return sub
+
+    def locate(self, template, threshold=0.9, region=None, scales=None, maxmatches=10):
+        """
+        Find where another image appears in this image, using normalized
+        cross correlation on an image pyramid: the full correlation is only
+        computed at a coarse resolution, and the candidates found are refined
+        at increasing resolutions. The template pyramids are cached in the
+        template MonkeyImage, so reuse the same template object between calls.
+
+        Returns a list of (MonkeyRect, score) tuples, the best match first.
+        The score is in the range -1.0 .. 1.0, with 1.0 for a perfect match.
 
+          Args:
+            template - The MonkeyImage to search for.
+            threshold - The minimum correlation score of a match. Defaults to 0.9
+            region - Optional tuple (x, y, w, h) limiting the search to a part of
+                     the image.
+            scales - Optional list of scale factors, to search for resized versions
+                     of the template, for example when the zoom level varies.
+                     Defaults to only the original size.
+            maxmatches - The maximum number of matches returned.
+        """
+        found = []
+        for scale in scales or (1.0,):
+            tpyr = template._templatePyramid(scale)
+            levels = self._pyramid(len(tpyr.levels) - 1)
+            for x, y, score in imagelib.matchtemplate(levels, tpyr, threshold, region, maxmatches):
+                found.append((score, x, y, tpyr.width, tpyr.height))
+
+        result = []
+        for score, x, y, w, h in sorted(found, reverse=True):
+            if any(abs(r.left + r.getWidth() / 2 - x - w / 2) < max(w, r.getWidth()) / 2 and
+                   abs(r.top + r.getHeight() / 2 - y - h / 2) < max(h, r.getHeight()) / 2 for r, _ in result):
+                continue
+            result.append((MonkeyRect(x, y, x + w, y + h), score))
+        return result[:maxmatches]
+
+    def perceptualHash(self, region=None, method="dhash", size=8):
+        """
+        Calculate a perceptual hash of the image, two images which look alike have
+        hashes which differ in only a few bits.
+
+        Returns a numpy array of uint64 words, containing size*size bits.
 
-    def rmsdiff(self, other):
+          Args:
+            region - Optional tuple (x, y, w, h) limiting the hash to a part of
+                     the image.
+            method - The hash function: 'dhash' or 'phash'.
+            size - The hash is calculated over a size x size thumbnail.
+        """
+        g = self._pyramid(0)[0]
+        x0, y0, x1, y1 = imagelib.cliprect(region, g.shape[1], g.shape[0])
+        return imagelib.packwords(imagelib.hashbits(g[y0:y1, x0:x1], method, size))
+
+    def regionHistogram(self, rect=None, bits=3):
+        """
+        Count the quantized colors in a region. This returns a numpy array
+        with 2**(3*bits) entries, indexed by color code, use imagelib.colorcode
+        to convert a "%x%x%x" style color string to an index.
+
+          Args:
+            rect - A tuple (x, y, w, h) describing the region to examine,
+                   or None for the whole image.
+            bits - The number of most significant bits kept of each channel, or a
+                   tuple (rbits, gbits, bbits).
+        """
+        plane = self._quantized(bits)
+        x0, y0, x1, y1 = imagelib.cliprect(rect, plane.shape[1], plane.shape[0])
+        return imagelib.histogram(plane[y0:y1, x0:x1], bits)
+
+    def rmsdiff(self, other, mask=None, region=None):
         """ Calculate the root-mean-square difference between two images
 
           Args:
             other - The other MonkeyImage object.
+            mask - Optional MonkeyImage or boolean array, only pixels where the mask
+                   is non zero are compared.
+            region - Optional tuple (x, y, w, h) limiting the comparison to a
+                     part of the image.
         """
-        import math, operator
-        try:
-            import reduce
-        except:
-            from functools import reduce
-        h = PIL.ImageChops.difference(self.img, other.img).histogram()
-        return math.sqrt(reduce(operator.add,
-            map(lambda h, i: h*(i**2), h, range(256))
-        ) / (float(self.img.size[0]) * other.img.size[1]))
+        import math
+        a, b, mask = self._comparable(other, mask, region)
+        npixels = a.shape[0] * a.shape[1] if mask is None else numpy.count_nonzero(mask)
+        if not npixels:
+            return 0.0
+        return math.sqrt(imagelib.sumsquares(a, b, mask) / (3.0 * npixels))
 
-    def sameAs(self, other, percent=1.0):
+    def sameAs(self, other, percent=1.0, tolerance=0, mask=None, region=None):
         """
         Compare this MonkeyImage object to another MonkeyImage object.
 
         This uses the same pixel-by-pixel binary counter as ChimpImageBase.
         https://android.googlesource.com/platform/tools/swt/+/master/chimpchat/src/main/java/com/android/chimpchat/core/ChimpImageBase.java
 
+        The comparison stops as soon as too many different pixels were found.
+
           Args:
             other - The other MonkeyImage object.
             percent - A float in the range 0.0 to 1.0, indicating the percentage of 
                       pixels that need to be the same for the method to return 'true'. 
                       Defaults to 1.0.
-        """
-        if (self.img.size != other.img.size): return False
-        numDiffPixels = 0
-        for tup in list(PIL.ImageChops.difference(self.img, other.img).getdata()):
-            if tup != (0,0,0,0) : numDiffPixels += 1
-        diffPercent = numDiffPixels / (self.img.size[0] * self.img.size[1])
-        return percent <= 1.0 - diffPercent
+            tolerance - The maximum difference per channel for pixels to be considered
+                        the same, either a single value or a (r, g, b, a) tuple.
+                        Defaults to 0.
+            mask - Optional MonkeyImage or boolean array, only pixels where the mask
+                   is non zero are compared.
+            region - Optional tuple (x, y, w, h) limiting the comparison to a
+                     part of the image.
+        """
+        if (self.size != other.size): return False
+        a, b, mask = self._comparable(other, mask, region)
+        npixels = a.shape[0] * a.shape[1] if mask is None else numpy.count_nonzero(mask)
+        if not npixels:
+            return True
+        maxdiff = int((1.0 - percent) * npixels + 1e-9)
+        numDiffPixels = imagelib.countdiff(a, b, tolerance, mask, maxdiff)
+        return numDiffPixels <= maxdiff
 
     def writeToFile(self, path, format=None):
         """
@@ -590,7 +1398,7 @@ class MonkeyImage:
                      Graphics format.
         """
 
-        self.img.save(path, format)
+        self._decoded().save(path, format)
 
 # -- end of MonkeyImage --
 
@@ -617,7 +1425,7 @@ class MonkeyRect:
         Returns a two item list that contains the x and y value of the center of the 
         rectangle
         """
-        return [ left + self.getWidth() / 2, top + self.getHeight() / 2 ]
+        return [ self.left + self.getWidth() / 2, self.top + self.getHeight() / 2 ]
 
     def getHeight(self):
         """
@@ -636,57 +1444,106 @@ class MonkeyRect:
 class MonkeyView:
     """
     Represents a view object.
+
+    A view is identified by a monkey `queryview` argument: either "viewid <id>",
+    or "accessibilityids <windowid> <viewid>". All attributes are fetched in one
+    batch on first use, and cached until input is sent, or the window changes.
     """
+    ATTRIBUTES = ("getaccessibilityids", "getchecked", "getclass", "getenabled",
+                  "getfocused", "getlocation", "getselected", "gettext")
+
+    def __init__(self, device, query):
+        self.device = device
+        self.query = query
+        self._attrs = None
+        self._gen = None
+
+    def _attr(self, name):
+        """
+        returns the result of a queryview command.
+        """
+        if self._attrs is None or self._gen != self.device._viewGeneration():
+            with self.device.mlib.batch() as b:
+                root = b.getrootview()
+                futures = [ (_, b.queryview(self.query, _)) for _ in self.ATTRIBUTES ]
+            self.device._setWindow(parseids(okvalue(root.response) or ""))
+            self._attrs = dict((_, okvalue(fut.response)) for _, fut in futures)
+            self._gen = self.device._viewGeneration()
+        if name not in self._attrs:
+            self._attrs[name] = self.device.mlib.queryview(self.query, name)
+        return self._attrs[name]
+
+    def _bool(self, name):
+        value = self._attr(name)
+        if value is not None:
+            return value == "true"
 
     def getAccessibilityIds(self):
         """
         Returns the accessibility ids of the current view
         """
+        ids = parseids(self._attr("getaccessibilityids") or "")
+        if ids:
+            return ids[0]
 
     def getChecked(self):
         """
         Get the checked status of the view
         """
+        return self._bool("getchecked")
 
     def getChildren(self):
         """
         Returns the children of the current view
         """
+        return self.device._viewsByIds(parseids(self._attr("getchildren") or ""))
 
     def getEnabled(self):
         """
         Returns the enabled status of the view
         """
+        return self._bool("getenabled")
 
     def getFocused(self):
         """
         Returns the focused status of the view
         """
+        return self._bool("getfocused")
 
     def getLocation(self):
         """
         Returns the location of the view in the form of a MonkeyRect
         """
+        value = self._attr("getlocation")
+        if value:
+            x, y, w, h = [ int(_) for _ in value.split() ]
+            return MonkeyRect(x, y, x + w, y + h)
 
     def getParent(self):
         """
         Returns the parent of the current view
         """
+        ids = parseids(self._attr("getparent") or "")
+        if ids:
+            return self.device._viewsByIds(ids)[0]
 
     def getSelected(self):
         """
         Returns the selected status of the view
         """
+        return self._bool("getselected")
 
     def getText(self):
         """
         Returns the text contained by the view
         """
+        return self._attr("gettext")
 
     def getViewClass(self):
         """
         Returns the class name of the view
         """
+        return self._attr("getclass")
 
     def setFocused(self, focused):
         """
@@ -695,6 +1552,8 @@ class MonkeyView:
           Args:
             focused - The boolean value to set focused to
         """
+        self.device.mlib.queryview(self.query, "setfocused %s" % ("true" if focused else "false"))
+        self._attrs = None
 
     def setSelected(self, selected):
         """
@@ -703,19 +1562,52 @@ class MonkeyView:
           Args:
             selected - The boolean value to set selected to
         """
+        self.device.mlib.queryview(self.query, "setselected %s" % ("true" if selected else "false"))
+        self._attrs = None
 
 # -- end of MonkeyView --
 
 class EasyMonkeyDevice:
     """
     MonkeyDevice with easier methods to refer to objects.
+
+    Objects are found in the ui hierarchy dumped by uiautomator, which is
+    kept until input is sent to the device, or for HIERARCHY_TTL seconds, as
+    the app can change its ui by itself. Selectors are looked up in the indexes
+    of the hierarchy.
     """
+    # seconds after which the hierarchy is loaded again, even without input.
+    HIERARCHY_TTL = 1.0
 
+    def __init__(self, device):
+        self.device = device
+        self.hierarchy = None
+        self._loadedInput = None    # device.lastinput when the hierarchy was loaded
+        self._loadedTime = 0.0      # time.monotonic() when the hierarchy was loaded
 
-    def __findattr_ex__(self):
+    def __getattr__(self, name):
         """
         Forwards unknown methods to the original MonkeyDevice object.
         """
+        return getattr(self.device, name)
+
+    def _tree(self):
+        if (self.hierarchy is None or self._loadedInput != self.device.lastinput
+                or time.monotonic() - self._loadedTime > self.HIERARCHY_TTL):
+            self._loadedInput = self.device.lastinput
+            self.hierarchy = dumphierarchy(self.device.adb)
+            self._loadedTime = time.monotonic()
+        return self.hierarchy
+
+    def _node(self, selector):
+        """
+        returns the first node matching the selector, raises an exception when there is none.
+        """
+        tree = self._tree()
+        nodes = selector.find(tree) if tree else []
+        if not nodes:
+            raise Exception("no object matching %s" % selector)
+        return nodes[0]
 
     def exists(self, selector):
         """
@@ -724,11 +1616,17 @@ class EasyMonkeyDevice:
           Args:
             selector - The selector identifying the object.
         """
+        tree = self._tree()
+        return bool(tree and selector.find(tree))
 
     def getFocusedWindowId(self):
         """
         Gets the id of the focused window.
         """
+        output = self.device.adb.runshell("dumpsys window windows")
+        m = re.search(r'mCurrentFocus=Window\{\S+ (?:\S+ )?([^}\s]+)\}', output or "")
+        if m:
+            return m.group(1)
 
     def getText(self, selector):
         """
@@ -737,14 +1635,25 @@ class EasyMonkeyDevice:
           Args:
             selector - The selector identifying the object.
         """
+        return self._tree().get(self._node(selector), "text")
 
     def locate(self, selector):
         """
         Locates the coordinates of the selected object.
+        Returns a (x, y, width, height) tuple.
 
           Args:
             selector - The selector identifying the object.
         """
+        l, t, r, b = self._tree().rect(self._node(selector))
+        return (l, t, r - l, b - t)
+
+    def refresh(self):
+        """
+        Load the hierarchy again on the next lookup, without waiting for
+        HIERARCHY_TTL to expire.
+        """
+        self.hierarchy = None
 
     def touch(self, selector, type):
         """
@@ -754,6 +1663,8 @@ class EasyMonkeyDevice:
             selector - The selector identifying the object.
             type - The event type as returned by TouchPressType().
         """
+        x, y, w, h = self.locate(selector)
+        self.device.touch(x + w // 2, y + h // 2, type)
 
     def type(self, selector, text):
         """
@@ -763,6 +1674,8 @@ class EasyMonkeyDevice:
             selector - The selector identifying the object.
             text - The text to type into the object.
         """
+        self.touch(selector, MonkeyDevice.DOWN_AND_UP)
+        self.device.type(text)
 
     def visible(self, selector):
         """
@@ -771,18 +1684,71 @@ class EasyMonkeyDevice:
           Args:
             selector - The selector identifying the object.
         """
+        tree = self._tree()
+        for i in (selector.find(tree) if tree else []):
+            l, t, r, b = tree.rect(i)
+            if r > l and b > t:
+                return True
+        return False
 
 # -- end of EasyMonkeyDevice -- 
 
 class By:
+    """
+    Selects objects in the ui hierarchy, for use with EasyMonkeyDevice.
+    """
+    def __init__(self, attribute, value):
+        self.attribute = attribute
+        self.value = value
+
+    def __str__(self):
+        return "%s=%s" % (self.attribute, self.value)
+
+    def find(self, hierarchy):
+        """
+        returns the list of matching nodes in the hierarchy.
+        """
+        return hierarchy.find(self.attribute, self.value)
+
+    @staticmethod
+    def cls(name):
+        """
+        Select an object by class name.
+
+          Args:
+            name - The class of the object, like android.widget.Button.
+        """
+        return By("class", name)
+
+    @staticmethod
+    def desc(description):
+        """
+        Select an object by content description.
 
-    def id(self, id):
+          Args:
+            description - The content-desc of the object.
+        """
+        return By("content-desc", description)
+
+    @staticmethod
+    def id(id):
         """
         Select an object by id.
 
           Args:
-            id - The identifier of the object.
+            id - The identifier of the object, either "id/name", or "package:id/name".
+        """
+        return By("resource-id", id)
+
+    @staticmethod
+    def text(text):
+        """
+        Select an object by its text.
+
+          Args:
+            text - The exact text of the object.
         """
+        return By("text", text)
 
 # -- end of By --
 
@@ -0,0 +1,206 @@
+"""
+Cached access to the properties of a device.
+
+Both the monkey variables (`listvar`/`getvar`), and the android system
+properties (`getprop`) are fetched all at once: the monkey variables with one
+pipelined batch of `getvar` commands, the system properties with a single
+shell command.
+"""
+from __future__ import print_function, division
+import os
+import re
+import json
+import time
+
+
+def parsegetprop(output):
+    """
+    returns a dict from the "[name]: [value]" lines printed by `getprop`.
+    """
+    props = {}
+    for m in re.finditer(r'^\[([^\]]*)\]: \[(.*)\]\s*$', output, re.M):
+        props[m.group(1)] = m.group(2)
+    return props
+
+
+class PropertyCache:
+    """
+    Caches the properties of one device.
+
+    Static properties, the build and display monkey variables and the
+    read-only `ro.*` system properties, are kept until the device reboots.
+    Dynamic properties are fetched again when they are older than `ttl` seconds,
+    the monkey variables and the system properties each on their own.
+    The clock and current activity variables are never cached.
+
+    A reboot is detected by a change of the kernel boot_id, which is fetched
+    together with the system properties.
+
+    The static properties can be saved on disk, a new session then only
+    checks the boot_id, before using them:
+
+        dev.properties.load("~/.monkeyprops.json")
+    """
+    STATIC_PREFIXES = ("build.", "display.", "ro.")
+    VOLATILE_PREFIXES = ("am.current.", "clock.")
+
+    def __init__(self, adb, mon, ttl=1.0):
+        self.adb = adb
+        self.mon = mon
+        self.ttl = ttl
+        self.path = None
+
+        self.bootid = None
+        self.verified = False   # True when bootid was checked in this session
+        self.varnames = None    # the names listed by monkey 'listvar'
+        self.static = {}
+        self.dynamic = {}       # the system properties
+        self.variables = {}     # the monkey variables
+        self.fetched = None     # time.monotonic() of the last getprop
+        self.varsfetched = None # time.monotonic() of the last getvar batch
+
+    def checkboot(self):
+        """
+        Discard the static properties when the device rebooted since they were fetched.
+        """
+        bootid = self.adb.runshell("cat /proc/sys/kernel/random/boot_id").strip().partition("\n")[0]
+        if bootid != self.bootid:
+            self.bootid = bootid
+            self.varnames = None
+            self.static = {}
+        self.verified = True
+
+    def isstatic(self, name):
+        return name.startswith(self.STATIC_PREFIXES)
+
+    def fetch(self):
+        """
+        Retrieve all monkey variables, and all system properties.
+        """
+        self.fetchprops()
+        self.fetchvars()
+
+    def fetchprops(self):
+        """
+        Retrieve all system properties, and check the boot_id.
+        """
+        output = self.adb.runshell("cat /proc/sys/kernel/random/boot_id; getprop")
+        bootid, _, output = output.partition("\n")
+        bootid = bootid.strip()
+        if bootid != self.bootid:
+            self.bootid = bootid
+            self.varnames = None
+            self.static = {}
+        self.verified = True
+        self.dynamic = self.store(parsegetprop(output))
+        self.fetched = time.monotonic()
+
+    def fetchvars(self):
+        """
+        Retrieve the monkey variables, static variables only the first time.
+        """
+        if not self.mon:
+            self.varnames = []
+            return
+        if self.varnames is None:
+            self.varnames = self.mon.listvar() or []
+        names = [ _ for _ in self.varnames if _ not in self.static and not _.startswith(self.VOLATILE_PREFIXES) ]
+        with self.mon.batch() as b:
+            futures = [ (name, b.command("getvar %s" % name)) for name in names ]
+        values = {}
+        for name, fut in futures:
+            if fut.response and fut.response.startswith("OK:"):
+                values[name] = fut.response[3:]
+        self.variables = self.store(values)
+        self.varsfetched = time.monotonic()
+
+    def store(self, values):
+        """
+        Add the static values to the cache, returns the dynamic values.
+        """
+        dynamic = {}
+        nstatic = len(self.static)
+        for name, value in values.items():
+            if self.isstatic(name):
+                self.static[name] = value
+            else:
+                dynamic[name] = value
+        if self.path and len(self.static) != nstatic:
+            self.save(self.path)
+        return dynamic
+
+    def expired(self, fetched):
+        return fetched is None or time.monotonic() - fetched > self.ttl
+
+    def get(self, name):
+        """
+        returns the value of a monkey variable, or system property.
+        """
+        if name.startswith(self.VOLATILE_PREFIXES) and self.mon:
+            return self.mon.getvar(name)
+        if name in self.static and not self.verified:
+            self.checkboot()
+        if name in self.static:
+            return self.static[name]
+        if self.varnames is None or self.fetched is None:
+            self.fetch()
+        elif name in self.varnames:
+            if self.expired(self.varsfetched):
+                self.fetchvars()
+        elif self.expired(self.fetched):
+            self.fetchprops()
+        return self.static.get(name, self.variables.get(name, self.dynamic.get(name)))
+
+    def names(self):
+        """
+        returns the names of the monkey variables.
+        """
+        if self.varnames is None:
+            self.fetch()
+        return self.varnames
+
+    def invalidate(self):
+        """
+        Forget all values, for example after a reboot.
+        """
+        self.bootid = None
+        self.verified = False
+        self.varnames = None
+        self.static = {}
+        self.dynamic = {}
+        self.variables = {}
+        self.fetched = None
+        self.varsfetched = None
+
+    def save(self, path):
+        """
+        Save the static properties in a json file, shared by all devices.
+        """
+        path = os.path.expanduser(path)
+        try:
+            with open(path) as fh:
+                devices = json.load(fh)
+        except (IOError, ValueError):
+            devices = {}
+        devices[self.adb.serialnr] = dict(bootid=self.bootid, varnames=self.varnames, static=self.static)
+        with open(path, "w") as fh:
+            json.dump(devices, fh, indent=1, sort_keys=True)
+
+    def load(self, path):
+        """
+        Load the static properties saved for this device, and save
+        them again to `path` after each fetch.
+        The saved values are discarded when the device rebooted since.
+        """
+        self.path = path
+        try:
+            with open(os.path.expanduser(path)) as fh:
+                entry = json.load(fh).get(self.adb.serialnr)
+        except (IOError, ValueError):
+            return
+        if entry:
+            self.bootid = entry["bootid"]
+            self.varnames = entry["varnames"]
+            self.static = entry["static"]
+            self.verified = False
+            self.checkboot()
@@ -0,0 +1,371 @@
+"""
+Screen level analysis, built on top of the monkeyrunner MonkeyImage.
+
+`ScreenIndex` - determine which known screen an image shows.
+`RuleSet` - evaluate a set of declarative color count rules in one pass.
+`ScreenWatcher` - only re-evaluate detectors for the parts of the screen which changed.
+`PositionTracker` - follow an object while the screen is being dragged.
+"""
+from __future__ import print_function, division
+import numpy
+import imagelib
+
+
+class ScreenIndex:
+    """
+    Index of labeled reference screenshots, stored as perceptual hashes.
+
+    Each screenshot is hashed over a list of regions, by default the whole screen.
+    Classifying an image is a nearest Hamming distance lookup over all references.
+
+    Usage:
+
+        idx = ScreenIndex(regions=[(0, 0, 1920, 200), None])
+        idx.add("IDLE", MonkeyRunner.loadImageFromFile("idle.png"))
+        idx.add("BUSY", MonkeyRunner.loadImageFromFile("busy.png"))
+        idx.save("screens.npz")
+
+        label, distance = ScreenIndex.load("screens.npz").classify(dev.takeSnapshot())
+    """
+    def __init__(self, regions=None, method="dhash", size=8):
+        self.regions = list(regions or [None])
+        self.method = method
+        self.size = size
+        self.labels = []
+        self.words = numpy.zeros((0, self.wordcount()), dtype=numpy.uint64)
+
+    def wordcount(self):
+        return len(self.regions) * ((self.size * self.size + 63) // 64)
+
+    def hash(self, image):
+        """
+        Calculate the hash of a MonkeyImage over all configured regions.
+        """
+        return numpy.concatenate([image.perceptualHash(region, self.method, self.size) for region in self.regions])
+
+    def add(self, label, image):
+        """
+        Add a reference MonkeyImage with the specified label.
+        """
+        self.labels.append(label)
+        self.words = numpy.vstack((self.words, self.hash(image)[None, :]))
+
+    def nearest(self, image, count=5):
+        """
+        returns a list of the `count` nearest (label, distance) pairs.
+        The distance is the number of different hash bits.
+        """
+        if not self.labels:
+            return []
+        dist = imagelib.hamming(self.words, self.hash(image))
+        order = numpy.argsort(dist, kind="stable")[:count]
+        return [ (self.labels[i], int(dist[i])) for i in order ]
+
+    def classify(self, image, maxdistance=None):
+        """
+        returns the (label, distance) of the nearest reference screen,
+        or None when no reference is within `maxdistance` bits.
+        """
+        best = self.nearest(image, 1)
+        if best and (maxdistance is None or best[0][1] <= maxdistance):
+            return best[0]
+
+    def save(self, path):
+        """
+        Save the index to a numpy .npz file.
+        """
+        regions = numpy.array([ r if r else (-1, -1, -1, -1) for r in self.regions ], dtype=numpy.int64)
+        with open(path, "wb") as fh:
+            numpy.savez_compressed(fh, words=self.words, labels=numpy.array(self.labels, dtype=str),
+                    regions=regions, method=self.method, size=self.size)
+
+    @staticmethod
+    def load(path):
+        """
+        Load an index saved with `save`.
+        """
+        with numpy.load(path) as data:
+            regions = [ tuple(int(_) for _ in r) if r[2] >= 0 else None for r in data["regions"] ]
+            idx = ScreenIndex(regions, str(data["method"]), int(data["size"]))
+            idx.labels = [ str(_) for _ in data["labels"] ]
+            idx.words = data["words"].reshape(len(idx.labels), idx.wordcount())
+        return idx
+
+
+class RuleSet:
+    """
+    A set of screen detection rules, declared as data.
+
+    A rule is a dict, either a color count:
+
+        { "region": (x, y, w, h), "colors": ["350", "351"], "bits": 3, "min": 400, "max": 1000 }
+
+      region - The area to count in, None or missing for the whole image.
+      colors - A quantized color code, or list of codes, as used by MonkeyImage.countColors.
+      bits - The quantization: bits per channel, or a (rbits, gbits, bbits) tuple. Default 3.
+      min, max - The inclusive range the number of matching pixels must be in.
+                 Either may be omitted.
+
+    or a boolean combination of rules:
+
+        { "all": [ rule, ... ] }
+        { "any": [ rule, ... ] }
+        { "not": rule }
+
+    A RuleSet is created from a dict of named rules. All rules are compiled together:
+    each quantization is computed once per image, and each distinct region is
+    counted with a single histogram, shared by all rules using that region.
+
+    Usage:
+
+        rules = RuleSet({
+            "PLUS": { "all": [
+                { "region": (1855, 90, 40, 35), "colors": "350", "min": 401 },
+                { "region": (1855, 90, 40, 35), "colors": "777", "min": 201 },
+            ] },
+            "IDLE": { "region": (1150, 50, 200, 50), "colors": "134", "min": 8001 },
+        })
+        results = rules.evaluate(dev.takeSnapshot())    # { "PLUS": True, "IDLE": False }
+    """
+    def __init__(self, rules):
+        self.names = list(rules)
+        self.groups = []        # distinct (bits, region) histograms
+        self.leaves = []        # (group index, color codes, min, max)
+        self.trees = [ self.compile(rules[name]) for name in self.names ]
+
+    def compile(self, rule):
+        """
+        Convert a rule to a tree of ("all"|"any", [subtrees]), ("not", subtree)
+        and ("leaf", leafindex) tuples.
+        """
+        unknown = set(rule) - set(["all", "any", "not", "region", "colors", "bits", "min", "max"])
+        if unknown:
+            raise Exception("unknown rule keys: %s" % ", ".join(sorted(unknown)))
+        for op in ("all", "any"):
+            if op in rule:
+                return op, [ self.compile(_) for _ in rule[op] ]
+        if "not" in rule:
+            return "not", self.compile(rule["not"])
+        if "colors" not in rule:
+            raise Exception("rule needs one of: all, any, not, colors")
+
+        bits = imagelib.channelbits(rule.get("bits", 3))
+        region = rule.get("region")
+        group = (bits, tuple(region) if region else None)
+        if group not in self.groups:
+            self.groups.append(group)
+        colors = rule["colors"]
+        if isinstance(colors, (str, int, tuple)):
+            colors = [colors]
+        codes = numpy.array(sorted(set(imagelib.colorcode(_, bits) for _ in colors)), dtype=numpy.intp)
+        self.leaves.append((self.groups.index(group), codes, rule.get("min"), rule.get("max")))
+        return "leaf", len(self.leaves) - 1
+
+    def measure(self, image):
+        """
+        returns the pixel count for each color count rule, in the order they were compiled.
+        """
+        histograms = [ image.regionHistogram(region, bits) for bits, region in self.groups ]
+        return [ int(histograms[group][codes].sum()) for group, codes, _, _ in self.leaves ]
+
+    def evaluate(self, image):
+        """
+        Evaluate all rules on a MonkeyImage, returns a dict with the result for each rule.
+        """
+        matched = [ (lo is None or count >= lo) and (hi is None or count <= hi)
+                    for count, (_, _, lo, hi) in zip(self.measure(image), self.leaves) ]
+
+        def check(tree):
+            op, arg = tree
+            if op == "leaf":
+                return matched[arg]
+            if op == "not":
+                return not check(arg)
+            if op == "all":
+                return all(check(_) for _ in arg)
+            return any(check(_) for _ in arg)
+
+        return dict( (name, check(tree)) for name, tree in zip(self.names, self.trees) )
+
+    def first(self, image):
+        """
+        returns the name of the first rule, in declaration order, which matches the image,
+        or None when no rule matches.
+        """
+        results = self.evaluate(image)
+        for name in self.names:
+            if results[name]:
+                return name
+
+
+class RegionWatcher:
+    """
+    A detector registered with a ScreenWatcher.
+
+    `result` holds the most recent detector result.
+    """
+    def __init__(self, region, detector, callback):
+        self.region = region
+        self.detector = detector
+        self.callback = callback
+        self.result = None
+        self.evaluated = False
+
+
+class ScreenWatcher:
+    """
+    Evaluates detectors on a stream of frames, only when their region changed.
+
+    Each frame is compared with the previous one in square tiles, and only
+    the detectors whose region overlaps a changed tile are evaluated again.
+    When the result of a detector changes, its callback is called.
+
+    Usage:
+
+        watcher = ScreenWatcher()
+        watcher.watch((1855, 90, 40, 35), hasGreenPlus, lambda w, plus: print("plus:", plus))
+        watcher.watch((1150, 50, 200, 50), rules.evaluate, onStatus)
+        while True:
+            watcher.feed(dev.takeSnapshot())
+    """
+    def __init__(self, tilesize=64, tolerance=0):
+        self.tilesize = tilesize
+        self.tolerance = tolerance
+        self.watchers = []
+        self.previous = None
+
+    def watch(self, region, detector, callback=None):
+        """
+        Register a detector for a region.
+
+          region - A tuple (x, y, w, h), or None for the whole screen.
+          detector - A function taking a MonkeyImage, and returning a result.
+          callback - Optional function called as callback(watcher, result),
+                     when the result changes.
+
+        returns the RegionWatcher object.
+        """
+        w = RegionWatcher(region, detector, callback)
+        self.watchers.append(w)
+        return w
+
+    def unwatch(self, w):
+        self.watchers.remove(w)
+
+    def tilerange(self, region, size):
+        """
+        returns the (row0, row1, col0, col1) range of tiles covering `region`.
+        """
+        ts = self.tilesize
+        x0, y0, x1, y1 = imagelib.cliprect(region, size[0], size[1])
+        return y0 // ts, -(-y1 // ts), x0 // ts, -(-x1 // ts)
+
+    def changedtiles(self, image):
+        """
+        Compare the image with the previous frame, only in the tiles covered
+        by a watcher. returns the tile array, and the (row, column) of its first tile.
+        """
+        ranges = [ self.tilerange(w.region, image.size) for w in self.watchers ]
+        r0, r1 = min(_[0] for _ in ranges), max(_[1] for _ in ranges)
+        c0, c1 = min(_[2] for _ in ranges), max(_[3] for _ in ranges)
+        ts = self.tilesize
+        dirty = self.previous.diffTiles(image, ts, self.tolerance, (c0 * ts, r0 * ts, (c1 - c0) * ts, (r1 - r0) * ts))
+        return dirty, r0, c0
+
+    def feed(self, image):
+        """
+        Process the next frame, returns the list of watchers whose result changed.
+        The first evaluation of a watcher always counts as a change.
+        """
+        dirty = None
+        if self.watchers and self.previous is not None and self.previous.size == image.size:
+            dirty, row, col = self.changedtiles(image)
+        self.previous = image
+
+        changed = []
+        for w in self.watchers:
+            if dirty is not None and w.evaluated:
+                r0, r1, c0, c1 = self.tilerange(w.region, image.size)
+                if not dirty[r0 - row:r1 - row, c0 - col:c1 - col].any():
+                    continue
+            first = not w.evaluated
+            w.evaluated = True
+            result = w.detector(image)
+            if first or result != w.result:
+                w.result = result
+                changed.append(w)
+                if w.callback:
+                    w.callback(w, result)
+        return changed
+
+
+class PositionTracker:
+    """
+    Follows an on-screen object during scroll and pan gestures.
+
+    After a drag, the object is expected to have moved by the drag distance,
+    so the detector is first run on a small window around the predicted
+    position. Only when it is not found there, the window is enlarged,
+    ending with a search of the whole screen.
+
+    The detector is a function called as detector(image, region), with region a
+    (x, y, w, h) tuple or None for the whole screen, returning the (x, y) position
+    of the object, or None when not found.
+
+    Usage:
+
+        def findSculptor(img, region):
+            hits = img.findDenseRegions(["022", "023", "032", "033"], (20, 20), 320, (10, 10), region)
+            if hits:
+                return hits[0][0].getCenter()
+
+        tracker = PositionTracker(findSculptor)
+        p = tracker.find(dev.takeSnapshot())
+        dev.drag((600, 600), (600, 800), 1.0, 10)
+        p = tracker.find(dev.takeSnapshot(), dev.mlib.lastdrag)
+    """
+    def __init__(self, detector, window=(200, 200), growth=2.0, gain=1.0):
+        """
+          window - The (w, h) size of the first search window.
+          growth - The factor by which the window grows after each miss.
+          gain - How far the object moves, relative to the drag distance.
+        """
+        self.detector = detector
+        self.window = window
+        self.growth = growth
+        self.gain = gain
+        self.position = None
+
+    def predict(self, gesture=None):
+        """
+        returns the expected position of the object after the (from, to) gesture.
+        """
+        if self.position is None:
+            return
+        x, y = self.position
+        if gesture:
+            (x0, y0), (x1, y1) = gesture
+            x += (x1 - x0) * self.gain
+            y += (y1 - y0) * self.gain
+        return x, y
+
+    def find(self, image, gesture=None):
+        """
+        Locate the object in a MonkeyImage, starting near its predicted position.
+        returns the position, or None when it was not found at all.
+        """
+        center = self.predict(gesture)
+        width, height = image.size
+        found = None
+        if center is not None:
+            w, h = self.window
+            while w < width or h < height:
+                region = (int(center[0] - w / 2), int(center[1] - h / 2), int(w), int(h))
+                found = self.detector(image, region)
+                if found:
+                    break
+                w, h = w * self.growth, h * self.growth
+        if not found:
+            found = self.detector(image, None)
+        self.position = found
+        return found